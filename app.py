@@ -2,32 +2,57 @@ import os
 from werkzeug.utils import secure_filename
 import re
 import json
+import click
 import datetime
 from datetime import datetime, date
 # Importa el nuevo formulario
 from forms import UserAdminForm 
 
-from flask import Flask, render_template, request, redirect, url_for, flash
+from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, send_file, abort, Response
 from flask_login import LoginManager, current_user, login_user, logout_user, login_required
 # En app.py, cambia la línea de importación por esta:
 from models import db, User, Receta, MenuSemanal, MenuSelection, TareaLimpieza, Lavadora, ShoppingItem, Ingredient, RecipeIngredient
+from models import refresh_recipe_stats, normalizar_texto, propagar_cambios_ingredientes, notify_weeks_changed
+from models import propagar_cambios_recetas
+import cache
+import photos
+import sqlstats
+import profiler
+import metrics
+from cache import week_cache, today_cache
 from forms import RecetaForm, LoginForm, RegistrationForm
 from datetime import datetime, timedelta, date # Asegúrate de importar esto
 from models import Exercise, WorkoutSession, WorkoutSet # Añadir a la lista existente
+from models import ExerciseRecord, refresh_exercise_records, refresh_session_calories
 from forms import ExerciseForm # Añadir a la lista existente
 from models import Routine, RoutineExercise # Añadir a la lista
 from forms import RoutineForm # Añadir a la lista
 from models import BodyMeasurement # Añadir
 from forms import BodyMeasurementForm # Añadir
-from sqlalchemy import inspect, text
+from sqlalchemy import inspect, text, case, func, select, insert, update, tuple_, literal
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import selectinload, joinedload
 # --- Configuración Inicial ---
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'clave_secreta_pro_home_os' # Cambia esto en producción
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///home_manager.db'
+# DATABASE_URL permite apuntar a otra BD (p.ej. la temporal de query_plans.py)
+app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', 'sqlite:///home_manager.db')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['UPLOAD_FOLDER'] = os.path.join('static', 'uploads')
+# Límite por petición: las fotos grandes van por /api/uploads en trozos (ver photos.py)
+app.config['MAX_CONTENT_LENGTH'] = 8 * 1024 * 1024
+# Caché de resúmenes semanales: 'lru' (memoria del proceso) o 'sqlite:///ruta' (compartida entre workers)
+app.config['WEEK_CACHE_URL'] = os.environ.get('WEEK_CACHE_URL', 'lru')
+# Panel de consultas SQL al pie de cada página: SQL_DEBUG_PANEL=1 (sin definir, solo en modo debug)
+if os.environ.get('SQL_DEBUG_PANEL'):
+    app.config['SQL_DEBUG_PANEL'] = os.environ['SQL_DEBUG_PANEL'] == '1'
 # Inicializar extensiones
 db.init_app(app)
+cache.init_app(app)
+photos.init_app(app)
+sqlstats.init_app(app)
+profiler.init_app(app)
+metrics.init_app(app)  # Después de sqlstats: lee su tiempo de BD antes de que lo limpie
 
 # --- Configuración de Login ---
 login = LoginManager(app)
@@ -77,47 +102,177 @@ def create_recipe():
     Crea una receta vinculando ingredientes existentes y sus cantidades.
     Recibe un JSON desde el frontend con la lista de ingredientes seleccionados.
     """
-    # Cargamos ingredientes para el desplegable (select)
-    all_ingredients = Ingredient.query.order_by(Ingredient.name).all()
-
     if request.method == 'POST':
         title = request.form.get('title')
         description = request.form.get('description')
         steps = request.form.get('steps')
         
-        # 1. Crear la Receta Base
-        new_recipe = Receta(
-            title=title, 
-            description=description, 
-            steps=steps, 
-            user_id=current_user.id
-        )
-        db.session.add(new_recipe)
-        db.session.flush() # Importante: Genera el ID de la receta antes de seguir
+        try:
+            # 1. Crear la Receta Base
+            new_recipe = Receta(
+                title=title, 
+                description=description, 
+                steps=steps, 
+                user_id=current_user.id
+            )
+            db.session.add(new_recipe)
+            db.session.flush() # Importante: Genera el ID de la receta antes de seguir
+
+            # 2. Procesar JSON de ingredientes (viene del JavaScript del Frontend)
+            guardar_ingredientes_receta(new_recipe.id, request.form.get('ingredients_data'))
+            db.session.commit()
+        except ValueError as e:
+            db.session.rollback()
+            print(f"Error procesando ingredientes: {e}")
+            flash(f'Hubo un error al guardar los ingredientes: {e}', 'error')
+            return redirect(url_for('create_recipe'))
 
-        # 2. Procesar JSON de ingredientes (viene del JavaScript del Frontend)
-        ing_data_json = request.form.get('ingredients_data')
-        
-        if ing_data_json:
-            try:
-                items = json.loads(ing_data_json)
-                for item in items:
-                    # Guardamos en la tabla intermedia (RecipeIngredient)
-                    assoc = RecipeIngredient(
-                        recipe_id=new_recipe.id,
-                        ingredient_id=int(item['id']),
-                        quantity_g=float(item['qty'])
-                    )
-                    db.session.add(assoc)
-            except Exception as e:
-                print(f"Error procesando ingredientes: {e}")
-                flash('Hubo un error al guardar los ingredientes.', 'error')
-        
-        db.session.commit()
         flash(f'Receta "{title}" creada correctamente.', 'success')
         return redirect(url_for('create_recipe'))
 
-    return render_template('food/create_recipe.html', ingredients=all_ingredients)
+    # El desplegable de ingredientes se rellena desde /api/search/ingredients
+    return render_template('food/create_recipe.html')
+
+
+# --- GUARDADO DE LÍNEAS (ingredientes de receta / ejercicios de rutina) ---
+
+def guardar_lineas(model, padre_col, padre_id, clave_col, filas, ref_col, ref_model):
+    """
+    Sincroniza las filas hijas de un padre (p.ej. RecipeIngredient de una receta)
+    con lo enviado por el formulario, tocando solo lo que cambia:
+      - comprueba todos los IDs referenciados con una única consulta IN
+      - INSERT/UPDATE/DELETE en bloque
+    'filas' es una lista de dicts con las columnas del modelo; 'clave_col' identifica
+    cada fila dentro del padre. Lanza ValueError si algún ID no existe.
+    """
+    tabla = model.__table__
+
+    # 1. Validar referencias de golpe
+    ref_ids = {f[ref_col] for f in filas}
+    if ref_ids:
+        existentes = set(db.session.execute(select(ref_model.id).where(ref_model.id.in_(ref_ids))).scalars())
+        if ref_ids - existentes:
+            raise ValueError(f"IDs inexistentes: {sorted(ref_ids - existentes)}")
+
+    # 2. Filas actuales del padre
+    pk_cols = [c.name for c in tabla.primary_key.columns]
+    actuales = {
+        row[clave_col]: row for row in
+        db.session.execute(select(tabla).where(tabla.c[padre_col] == padre_id)).mappings()
+    }
+
+    # 3. Diff
+    a_insertar, a_actualizar = [], []
+    for fila in filas:
+        fila = dict(fila, **{padre_col: padre_id})
+        actual = actuales.pop(fila[clave_col], None)
+        if actual is None:
+            a_insertar.append(fila)
+        elif any(actual[k] != v for k, v in fila.items()):
+            cambio = {k: actual[k] for k in pk_cols}
+            cambio.update({k: v for k, v in fila.items() if k not in pk_cols and actual[k] != v})
+            a_actualizar.append(cambio)
+
+    # 4. Escribir en bloque
+    if actuales:
+        db.session.execute(tabla.delete().where(
+            tabla.c[padre_col] == padre_id,
+            tabla.c[clave_col].in_(list(actuales.keys()))
+        ))
+    if a_actualizar:
+        db.session.execute(update(model), a_actualizar)
+    if a_insertar:
+        db.session.execute(insert(model), a_insertar)
+    return len(a_insertar), len(a_actualizar), len(actuales)
+
+
+def guardar_ingredientes_receta(recipe_id, ing_data_json):
+    """JSON [{id, qty}, ...] del editor de recetas -> RecipeIngredient (los repetidos se suman)."""
+    cantidades = {}
+    try:
+        for item in json.loads(ing_data_json or '[]'):
+            ing_id = int(item['id'])
+            cantidades[ing_id] = cantidades.get(ing_id, 0) + float(item['qty'])
+    except (KeyError, TypeError, json.JSONDecodeError) as e:
+        raise ValueError(f"JSON de ingredientes no válido: {e}")
+
+    filas = [{'ingredient_id': i, 'quantity_g': q} for i, q in cantidades.items()]
+    cambios = guardar_lineas(RecipeIngredient, 'recipe_id', recipe_id, 'ingredient_id',
+                             filas, 'ingredient_id', Ingredient)
+    if any(cambios):
+        # Las escrituras en bloque no pasan por los eventos del ORM
+        propagar_cambios_recetas(db.session, {recipe_id})
+    return cambios
+
+
+def guardar_ejercicios_rutina(routine_id, exercises_json, series_por_defecto):
+    """JSON [{id, series, rest, distance, time}, ...] del editor de rutinas -> RoutineExercise (clave: posición)."""
+    filas = []
+    try:
+        for i, item in enumerate(json.loads(exercises_json or '[]')):
+            filas.append({
+                'order': i,
+                'exercise_id': int(item['id']),
+                'series': int(item.get('series') or series_por_defecto),
+                'rest_seconds': int(item.get('rest') or 60),
+                'target_distance': float(item.get('distance') or 0),
+                'target_time': int(item.get('time') or 0)
+            })
+    except (KeyError, TypeError, json.JSONDecodeError) as e:
+        raise ValueError(f"JSON de ejercicios no válido: {e}")
+
+    return guardar_lineas(RoutineExercise, 'routine_id', routine_id, 'order',
+                          filas, 'exercise_id', Exercise)
+
+
+@app.route('/api/search/<tipo>')
+@login_required
+def api_search(tipo):
+    """
+    Autocompletado paginado en formato Select2 ({results, pagination}).
+    Primero los que EMPIEZAN por el texto (rango sobre la columna indexada)
+    y después los que lo contienen. Ignora mayúsculas y tildes.
+    """
+    if tipo == 'ingredients':
+        model, col = Ingredient, Ingredient.name_search
+        base = Ingredient.query
+    elif tipo == 'recipes':
+        # Solo las recetas del usuario (índice user_id, title_search), como en /recetas
+        model, col = Receta, Receta.title_search
+        base = Receta.query.filter(Receta.user_id == current_user.id)
+    else:
+        return jsonify({'error': 'Tipo no válido'}), 404
+
+    q = normalizar_texto(request.args.get('q', ''))
+    page = max(request.args.get('page', 1, type=int), 1)
+    per_page = min(max(request.args.get('per_page', 20, type=int), 1), 50)
+    offset = (page - 1) * per_page
+
+    # 1. Coincidencias por prefijo: q <= col < q + '\uffff' usa el índice
+    por_prefijo = base.filter(col >= q, col < q + '\uffff')
+    total_prefijo = por_prefijo.count()
+
+    # Pedimos uno de más para saber si hay otra página
+    encontrados = por_prefijo.order_by(col).offset(offset).limit(per_page + 1).all()
+
+    # 2. Si no llenamos la página, completamos con "contiene" (excluyendo los de prefijo)
+    if q and len(encontrados) <= per_page:
+        contiene = base.filter(
+            col.contains(q, autoescape=True),
+            ~((col >= q) & (col < q + '\uffff'))
+        ).order_by(col)
+        offset_contiene = max(offset - total_prefijo, 0)
+        encontrados += contiene.offset(offset_contiene).limit(per_page + 1 - len(encontrados)).all()
+
+    hay_mas = len(encontrados) > per_page
+    results = []
+    for obj in encontrados[:per_page]:
+        if tipo == 'ingredients':
+            results.append({'id': obj.id, 'text': obj.name, 'kcal': obj.kcal_100g, 'price': obj.price_kg})
+        else:
+            results.append({'id': obj.id, 'text': obj.title})
+
+    return jsonify({'results': results, 'pagination': {'more': hay_mas}})
 
 
 # --- RUTAS DE AUTENTICACIÓN ---
@@ -168,90 +323,113 @@ def logout():
 @app.route('/')
 @login_required
 def dashboard():
-    from datetime import date, timedelta, datetime
-    
-    # 1. Fechas base
     hoy = date.today()
-    dias_semana = ["Lunes", "Martes", "Miércoles", "Jueves", "Viernes", "Sábado", "Domingo"]
-    dia_actual_str = dias_semana[hoy.weekday()]
     inicio_semana_actual = hoy - timedelta(days=hoy.weekday())
-    
-    # Rango de tiempo para "HOY"
-    today_start = datetime(hoy.year, hoy.month, hoy.day)
-    today_end = today_start + timedelta(days=1)
-
-    # 2. Consultas básicas
-    menu_hoy = MenuSemanal.query.filter_by(
-        user_id=current_user.id, 
-        dia=dia_actual_str,
-        week_start=inicio_semana_actual
-    ).first()
-
-    workout_hoy = WorkoutSession.query.filter(
-        WorkoutSession.user_id == current_user.id,
-        WorkoutSession.date >= today_start,
-        WorkoutSession.date < today_end
-    ).first()
-
-    peso_hoy = BodyMeasurement.query.filter(
-        BodyMeasurement.user_id == current_user.id,
-        BodyMeasurement.date >= today_start,
-        BodyMeasurement.date < today_end
-    ).first()
-
-    # 3. CÁLCULO DEL PROGRESO (GRÁFICA HISTÓRICA)
-    first_m = BodyMeasurement.query.filter_by(user_id=current_user.id).order_by(BodyMeasurement.date.asc()).first()
-    last_m = BodyMeasurement.query.filter_by(user_id=current_user.id).order_by(BodyMeasurement.date.desc()).first()
-    
-    progress_list = []
-    if first_m and last_m:
-        metrics = [('weight', 'Peso', 'kg'), ('chest', 'Pecho', 'cm'), ('biceps', 'Bíceps', 'cm'), 
-                   ('hips', 'Cadera', 'cm'), ('thigh', 'Muslo', 'cm'), ('calf', 'Gemelo', 'cm')]
-        for field, label, unit in metrics:
-            val_start = getattr(first_m, field)
-            val_end = getattr(last_m, field)
-            if val_start is not None and val_end is not None:
-                diff = val_end - val_start
-                if abs(diff) > 0:
-                    progress_list.append({'label': label, 'diff': round(diff, 2), 'unit': unit})
-
-    # 4. CÁLCULO DE DIFERENCIA DIARIA DE PESO (NUEVO)
-    weight_diff = None
-    if peso_hoy:
-        # Buscamos el último registro que sea ANTERIOR a hoy
-        peso_ayer = BodyMeasurement.query.filter(
-            BodyMeasurement.user_id == current_user.id,
-            BodyMeasurement.date < today_start
-        ).order_by(BodyMeasurement.date.desc()).first()
-        
-        if peso_ayer and peso_ayer.weight:
-            weight_diff = peso_hoy.weight - peso_ayer.weight
 
-    # 5. CÁLCULO DE BALANCE CALÓRICO
-    kcal_ingesta = menu_hoy.daily_stats['kcal'] if menu_hoy else 0
-    kcal_quemadas = workout_hoy.total_calories if workout_hoy else 0
-    kcal_basal = current_user.basal_metabolism or 0
+    # 1. Resumen de hoy (menú, entreno, medidas): cacheado por usuario hasta que cambie algo
+    hoy_snap = today_cache.get(current_user.id, hoy)
+
+    # 2. CÁLCULO DE BALANCE CALÓRICO (resumen semanal cacheado)
+    resumen_semana = week_cache.get(current_user.id, inicio_semana_actual)
+    kcal_ingesta = resumen_semana['dias'].get(hoy_snap['dia'], {}).get('kcal', 0)
+    kcal_quemadas = hoy_snap['workout']['total_calories'] if hoy_snap['workout'] else 0
+    kcal_basal = hoy_snap['kcal_basal']
     
     limite_diario = kcal_basal + kcal_quemadas
     balance = limite_diario - kcal_ingesta
 
     return render_template('dashboard.html', 
-                           menu=menu_hoy, 
-                           workout=workout_hoy,
-                           peso=peso_hoy,
-                           progress=progress_list,
+                           menu=hoy_snap['menu'], 
+                           workout=hoy_snap['workout'],
+                           peso=hoy_snap['peso'],
+                           progress=hoy_snap['progress'],
                            kcal_ingesta=kcal_ingesta,
                            kcal_quemadas=kcal_quemadas,
                            kcal_basal=kcal_basal,
                            balance=balance,
-                           weight_diff=weight_diff) # <--- Pasamos la nueva variable
+                           weight_diff=hoy_snap['weight_diff'])
+
+# Columnas por las que se puede ordenar el recetario (todas con índice (user_id, col, id))
+ORDEN_RECETAS = {
+    'recent': Receta.id,
+    'title': Receta.title_search,
+    'kcal': Receta.kcal,
+    'price': Receta.precio,
+    'ingredients': Receta.n_ingredientes,
+}
+RECETAS_POR_PAGINA = 25
+
 
 @app.route('/recetas')
 @login_required
 def recetas_page():
-    # Mostrar recetas solo del usuario, ordenadas por la más reciente
-    recetas = Receta.query.order_by(Receta.id.desc()).all()
-    return render_template('food/recetas.html', recetas=recetas)    
+    """
+    Recetario del usuario paginado en el servidor por keyset: en vez de OFFSET,
+    cada página empieza justo después (o antes) de la última fila vista,
+    así el coste no depende del tamaño de la tabla.
+    """
+    sort = request.args.get('sort', 'recent')
+    if sort not in ORDEN_RECETAS:
+        sort = 'recent'
+    direction = request.args.get('dir', 'desc' if sort == 'recent' else 'asc')
+    desc = direction == 'desc'
+    q = request.args.get('q', '').strip()
+
+    col = ORDEN_RECETAS[sort]
+    base = Receta.query.filter(Receta.user_id == current_user.id)
+    if q:
+        base = base.filter(Receta.title_search.contains(normalizar_texto(q), autoescape=True))
+    total = base.count()
+
+    # Cursor: "valor:id" de la última (after) o primera (before) fila de la página
+    after = request.args.get('after')
+    before = request.args.get('before')
+    cursor = after or before
+    # Si venimos hacia atrás recorremos en orden inverso y luego damos la vuelta
+    backwards = bool(before) and not after
+    ascending = desc == backwards
+
+    query = base
+    if cursor:
+        try:
+            raw_val, raw_id = cursor.rsplit(':', 1)
+            val = raw_val if sort == 'title' else (int(raw_val) if sort in ('recent', 'ingredients') else float(raw_val))
+            key = (tuple_(col, Receta.id) > tuple_(val, int(raw_id))) if ascending \
+                else (tuple_(col, Receta.id) < tuple_(val, int(raw_id)))
+            query = query.filter(key)
+        except ValueError:
+            cursor = None
+
+    if ascending:
+        query = query.order_by(col.asc(), Receta.id.asc())
+    else:
+        query = query.order_by(col.desc(), Receta.id.desc())
+
+    # Uno de más para saber si hay más páginas en esa dirección
+    recetas = query.options(joinedload(Receta.user)).limit(RECETAS_POR_PAGINA + 1).all()
+    hay_mas = len(recetas) > RECETAS_POR_PAGINA
+    recetas = recetas[:RECETAS_POR_PAGINA]
+    if backwards:
+        recetas.reverse()
+
+    def cursor_de(r):
+        return f"{getattr(r, col.key)}:{r.id}"
+
+    next_cursor = prev_cursor = None
+    if recetas:
+        if (hay_mas and not backwards) or (backwards and cursor):
+            next_cursor = cursor_de(recetas[-1])
+        if (hay_mas and backwards) or (not backwards and cursor):
+            prev_cursor = cursor_de(recetas[0])
+
+    return render_template('food/recetas.html',
+                           recetas=recetas,
+                           total=total,
+                           sort=sort,
+                           direction='desc' if desc else 'asc',
+                           q=q,
+                           next_cursor=next_cursor,
+                           prev_cursor=prev_cursor)
 
 
 @app.route('/add_recipe', methods=['GET', 'POST'])
@@ -349,56 +527,27 @@ def menu_semanal_page(week_str=None):
     # -----------------------------------------------------------
     if request.method == 'POST':
         try:
+            # A. Leer del formulario lo que el usuario quiere para cada día
+            deseado = {}
             for dia in dias_semana:
-                # A. Buscar o Crear el registro del Día (padre)
-                menu_dia = MenuSemanal.query.filter_by(
-                    user_id=current_user.id,
-                    week_start=current_week,  # <--- CORREGIDO: Objeto date puro
-                    dia=dia
-                ).first()
-
-                # 2. CREAR (Insert): Aquí es donde fallaba tu error INSERT
-                if not menu_dia:
-                    menu_dia = MenuSemanal(
-                        user_id=current_user.id,
-                        week_start=current_week, # <--- CORREGIDO: Objeto date puro
-                        dia=dia
-                    )
-                    db.session.add(menu_dia)
-                    db.session.commit()
-
-                # B. Limpiar selecciones previas (CORREGIDO: usa menu_id)
-                MenuSelection.query.filter_by(menu_id=menu_dia.id).delete()
-                
-                # C. Guardar las nuevas selecciones
+                filas = []
                 for tipo in tipos_comida:
                     # -- RECETAS --
-                    recetas_ids = request.form.getlist(f"{dia}_{tipo}_receta")
-                    for r_id in recetas_ids:
+                    for r_id in request.form.getlist(f"{dia}_{tipo}_receta"):
                         if r_id and r_id != "":
-                            sel = MenuSelection(
-                                menu_id=menu_dia.id,    # Corregido
-                                tipo_comida=tipo,       # Corregido
-                                receta_id=int(r_id)
-                            )
-                            db.session.add(sel)
+                            filas.append((tipo, int(r_id), None, 0.0))
 
                     # -- INGREDIENTES SUELTOS --
                     ing_ids = request.form.getlist(f"{dia}_{tipo}_ing_id")
                     ing_qtys = request.form.getlist(f"{dia}_{tipo}_ing_qty")
-                    
                     for i_id, i_qty in zip(ing_ids, ing_qtys):
                         if i_id and i_id != "":
                             cantidad = float(i_qty) if i_qty else 0
-                            sel = MenuSelection(
-                                menu_id=menu_dia.id,    # Corregido
-                                tipo_comida=tipo,       # Corregido
-                                ingredient_id=int(i_id),
-                                quantity=cantidad
-                            )
-                            db.session.add(sel)
+                            filas.append((tipo, None, int(i_id), cantidad))
+                deseado[dia] = filas
 
-            db.session.commit()
+            # B. Guardar solo las diferencias, todo en una transacción
+            guardar_menu_semanal(current_user.id, current_week, deseado)
             flash('Menú guardado correctamente.', 'success')
             return redirect(url_for('menu_semanal_page', week_str=current_week))
 
@@ -411,16 +560,13 @@ def menu_semanal_page(week_str=None):
     # 3. Preparación de Datos (GET)
     # -----------------------------------------------------------
     menu = []
+
+    # 1. Cargar la semana entera (días + selecciones + recetas + ingredientes) de golpe
+    semana_db = MenuSemanal.load_week(current_user.id, current_week)
     
     # Usamos enumerate para calcular la fecha exacta de cada día
     for i, dia in enumerate(dias_semana):
-        
-        # 1. Obtener datos de la DB
-        dia_db = MenuSemanal.query.filter_by(
-            user_id=current_user.id, 
-            week_start=current_week.strftime('%Y-%m-%d'),
-            dia=dia
-        ).first()
+        dia_db = semana_db.get(dia)
 
         # 2. Calcular la fecha visual (ej: 12/05)
         fecha_real = current_week + timedelta(days=i)
@@ -439,10 +585,13 @@ def menu_semanal_page(week_str=None):
             dummy.fecha_str = fecha_formateada # Inyectamos la fecha
             menu.append(dummy)
 
-    # Generar lista de compra y cargar catálogos
-    lista_compra = generar_lista_compra_db(menu)
-    recetas = Receta.query.order_by(Receta.title).all()
-    all_ingredients = Ingredient.query.order_by(Ingredient.name).all()
+    # Totales diarios desde el resumen semanal cacheado
+    resumen_semana = week_cache.get(current_user.id, current_week)
+    for dia_menu in menu:
+        dia_menu.stats = resumen_semana['dias'].get(dia_menu.dia, {'kcal': 0, 'price': 0})
+
+    # Generar lista de compra (los catálogos se piden a /api/search al escribir)
+    lista_compra = generar_lista_compra_db(current_user.id, current_week)
 
     # Navegación
     prev_week = (current_week - timedelta(weeks=1)).strftime('%Y-%m-%d')
@@ -454,39 +603,270 @@ def menu_semanal_page(week_str=None):
                            prev_week=prev_week,
                            next_week=next_week,
                            menu=menu,
-                           recetas=recetas,
-                           all_ingredients=all_ingredients,
                            lista_compra=lista_compra
                            )
 
 
-def generar_lista_compra_db(menu_items):
-    compra = {}
-    tipos = ['Desayuno', 'Comida', 'Merienda', 'Cena']
+def guardar_menu_semanal(user_id, week_start, deseado):
+    """
+    Guarda una semana comparando lo enviado con lo que ya hay en la base de datos.
+    'deseado' es {dia: [(tipo_comida, receta_id, ingredient_id, cantidad), ...]}.
+    Solo se insertan/borran las selecciones que cambian, con operaciones masivas
+    y un único commit.
+    """
+    from collections import Counter
+
+    def clave(tipo, receta_id, ingredient_id, cantidad):
+        # Las recetas no usan cantidad; redondeamos para no comparar floats "ruidosos"
+        return (tipo, receta_id, ingredient_id, 0.0 if receta_id else round(cantidad or 0, 3))
+
+    def cargar_dias():
+        return {d.dia: d for d in MenuSemanal.query.filter_by(user_id=user_id, week_start=week_start)
+                .options(selectinload(MenuSemanal.selecciones)).all()}
+
+    # 1. Cargar días y selecciones actuales (2 consultas)
+    dias_db = cargar_dias()
+
+    # 2. Crear los días que falten. ON CONFLICT evita duplicados si dos
+    #    dispositivos guardan la misma semana a la vez.
+    dias_nuevos = [dia for dia, filas in deseado.items() if filas and dia not in dias_db]
+    if dias_nuevos:
+        db.session.execute(
+            sqlite_insert(MenuSemanal.__table__)
+            .values([{'user_id': user_id, 'week_start': week_start, 'dia': dia} for dia in dias_nuevos])
+            .on_conflict_do_nothing(index_elements=['user_id', 'week_start', 'dia'])
+        )
+        dias_db = cargar_dias()
+
+    # 3. Calcular el diff por día
+    a_borrar = []
+    a_insertar = []
+    for dia, filas in deseado.items():
+        menu_dia = dias_db.get(dia)
+        if menu_dia is None:
+            continue
+
+        pendientes = Counter(clave(*f) for f in filas)
+        for sel in menu_dia.selecciones:
+            k = clave(sel.tipo_comida, sel.receta_id, sel.ingredient_id, sel.quantity)
+            if pendientes[k] > 0:
+                pendientes[k] -= 1 # Ya existe: no se toca
+            else:
+                a_borrar.append(sel.id)
+
+        for (tipo, receta_id, ingredient_id, cantidad), n in pendientes.items():
+            for _ in range(n):
+                a_insertar.append({
+                    'menu_id': menu_dia.id,
+                    'tipo_comida': tipo,
+                    'receta_id': receta_id,
+                    'ingredient_id': ingredient_id,
+                    'quantity': cantidad
+                })
+
+    # 4. Escribir en bloque (fuera del ORM, así que avisamos a mano a la caché)
+    if a_borrar:
+        db.session.execute(MenuSelection.__table__.delete().where(MenuSelection.id.in_(a_borrar)))
+    if a_insertar:
+        db.session.execute(MenuSelection.__table__.insert(), a_insertar)
+    if a_borrar or a_insertar:
+        notify_weeks_changed(db.session, {(user_id, week_start)})
+    db.session.commit()
+    return len(a_insertar), len(a_borrar)
+
+
+def copiar_semana(user_id, origen, destinos):
+    """
+    Clona los días y selecciones de la semana 'origen' en cada semana de 'destinos'
+    con INSERT ... SELECT (sin pasar fila a fila por el ORM), en una sola transacción.
+    Lo que hubiera planificado en las semanas destino se sustituye.
+    Devuelve el número de selecciones copiadas.
+    """
+    menu = MenuSemanal.__table__
+    ms = MenuSelection.__table__
+    src = menu.alias('src')
+    dst = menu.alias('dst')
+
+    copiadas = 0
+    for destino in destinos:
+        if destino == origen:
+            continue
+
+        # 1. Vaciar las selecciones de la semana destino
+        db.session.execute(ms.delete().where(ms.c.menu_id.in_(
+            select(menu.c.id).where(menu.c.user_id == user_id, menu.c.week_start == destino)
+        )))
+
+        # 2. Días que falten en destino (mismo 'dia' que en origen)
+        db.session.execute(
+            sqlite_insert(menu).from_select(
+                ['user_id', 'week_start', 'dia'],
+                select(src.c.user_id, literal(destino, type_=menu.c.week_start.type), src.c.dia)
+                .where(src.c.user_id == user_id, src.c.week_start == origen)
+            ).on_conflict_do_nothing(index_elements=['user_id', 'week_start', 'dia'])
+        )
+
+        # 3. Selecciones: cada una se cuelga del día equivalente en destino
+        result = db.session.execute(
+            ms.insert().from_select(
+                ['menu_id', 'tipo_comida', 'receta_id', 'ingredient_id', 'quantity'],
+                select(dst.c.id, ms.c.tipo_comida, ms.c.receta_id, ms.c.ingredient_id, ms.c.quantity)
+                .select_from(
+                    ms.join(src, src.c.id == ms.c.menu_id)
+                      .join(dst, (dst.c.user_id == src.c.user_id) & (dst.c.dia == src.c.dia))
+                )
+                .where(src.c.user_id == user_id, src.c.week_start == origen, dst.c.week_start == destino)
+                .order_by(ms.c.id)
+            )
+        )
+        copiadas += result.rowcount or 0
+
+    notify_weeks_changed(db.session, {(user_id, d) for d in destinos if d != origen})
+    db.session.commit()
+    return copiadas
+
+
+@app.route('/menu/<week_str>/copy', methods=['POST'])
+@login_required
+def copy_menu_week(week_str):
+    try:
+        origen = datetime.strptime(week_str, '%Y-%m-%d').date()
+        destino = datetime.strptime(request.form.get('target', ''), '%Y-%m-%d').date()
+        repeat = int(request.form.get('repeat') or 1)
+    except ValueError:
+        flash('Fecha o número de semanas no válido.', 'error')
+        return redirect(url_for('menu_semanal_page', week_str=week_str))
+
+    # Normalizamos al lunes de la semana elegida; como mucho un año de golpe
+    destino = destino - timedelta(days=destino.weekday())
+    repeat = min(max(repeat, 1), 52)
+    destinos = [destino + timedelta(weeks=i) for i in range(repeat)]
+
+    try:
+        copiadas = copiar_semana(current_user.id, origen, destinos)
+        flash(f'Menú copiado a {len(destinos)} semana(s) ({copiadas} platos).', 'success')
+    except Exception as e:
+        db.session.rollback()
+        print(f"Error copiando semana: {e}")
+        flash(f'Error al copiar: {e}', 'error')
+        return redirect(url_for('menu_semanal_page', week_str=week_str))
+
+    return redirect(url_for('menu_semanal_page', week_str=destino.strftime('%Y-%m-%d')))
 
-    for item in menu_items:
-        for tipo in tipos:
-            # Usamos el nuevo método get_selections que devuelve todo
-            selecciones = item.get_selections(tipo)
-            
-            for sel in selecciones:
-                # CASO A: Es Receta
-                if sel.receta:
-                    for assoc in sel.receta.ingredients_assoc:
-                        key = (assoc.ingredient.name, "g")
-                        compra[key] = compra.get(key, 0) + assoc.quantity_g
-                
-                # CASO B: Es Ingrediente Suelto
-                elif sel.ingredient:
-                    key = (sel.ingredient.name, "g")
-                    compra[key] = compra.get(key, 0) + sel.quantity
+
+def generar_lista_compra_db(user_id, week_start):
+    """
+    Lista de la compra de una semana con un único GROUP BY en SQL.
+    Las selecciones de receta se expanden con sus RecipeIngredient y las de
+    ingrediente suelto usan su propia cantidad. Incluye un coste estimado por línea.
+    """
+    ms = MenuSelection.__table__
+    ri = RecipeIngredient.__table__
+    ing = Ingredient.__table__
+    menu = MenuSemanal.__table__
+
+    # Receta -> gramos de cada ingrediente; ingrediente suelto -> su cantidad
+    gramos = case((ms.c.receta_id.isnot(None), ri.c.quantity_g), else_=ms.c.quantity)
+    total_g = func.sum(gramos)
+
+    stmt = (
+        select(ing.c.id, ing.c.name, total_g.label('gramos'), (total_g / 1000.0 * ing.c.price_kg).label('coste'))
+        .select_from(
+            ms.join(menu, menu.c.id == ms.c.menu_id)
+              .outerjoin(ri, ri.c.recipe_id == ms.c.receta_id)
+              .join(ing, ing.c.id == func.coalesce(ri.c.ingredient_id, ms.c.ingredient_id))
+        )
+        .where(menu.c.user_id == user_id, menu.c.week_start == week_start)
+        .group_by(ing.c.id, ing.c.name, ing.c.price_kg)
+        .order_by(ing.c.name)
+    )
 
     resultado = []
-    for (nombre, unidad), cantidad in sorted(compra.items()):
-        resultado.append({'nombre': nombre, 'unidad': unidad, 'cantidad': round(cantidad, 1)})
+    for row in db.session.execute(stmt):
+        resultado.append({
+            'ingredient_id': row.id,
+            'nombre': row.name,
+            'unidad': 'g',
+            'cantidad': round(row.gramos or 0, 1),
+            'coste': round(row.coste or 0, 2)
+        })
     return resultado
 
 
+def sincronizar_lista_compra(user_id, lista):
+    """
+    Vuelca la lista generada en ShoppingItem (is_auto=True) con operaciones masivas.
+    No toca los artículos manuales ni los ya marcados como comprados: si uno de ellos
+    se llama igual que una línea generada, esa línea se omite en vez de duplicarla.
+    Los automáticos pendientes que ya no salen en el menú (o repetidos) se eliminan.
+    """
+    # 1. Lo que ya hay: automáticos pendientes por nombre (puede haber repetidos)
+    #    y nombres ocupados por artículos manuales o comprados
+    auto_pendientes = {}
+    ocupados = set()
+    for item in ShoppingItem.query.filter_by(user_id=user_id).order_by(ShoppingItem.id):
+        if item.is_auto and not item.completed:
+            auto_pendientes.setdefault(item.nombre, []).append(item.id)
+        else:
+            ocupados.add(item.nombre)
+
+    # 2. Una línea por nombre (dos ingredientes pueden llamarse igual)
+    por_nombre = {}
+    for linea in lista:
+        if linea['nombre'] in por_nombre:
+            por_nombre[linea['nombre']]['cantidad'] += linea['cantidad']
+        else:
+            por_nombre[linea['nombre']] = dict(linea)
+
+    a_actualizar = []
+    a_insertar = []
+    for nombre, linea in por_nombre.items():
+        ids = auto_pendientes.pop(nombre, None)
+        if ids:
+            a_actualizar.append({'id': ids[0], 'cantidad': linea['cantidad'], 'unidad': linea['unidad']})
+            if len(ids) > 1:
+                auto_pendientes[nombre] = ids[1:]  # Repetidos: se borran abajo
+        elif nombre not in ocupados:
+            a_insertar.append({
+                'nombre': nombre,
+                'cantidad': linea['cantidad'],
+                'unidad': linea['unidad'],
+                'completed': False,
+                'is_auto': True,
+                'user_id': user_id
+            })
+
+    a_borrar = [item_id for ids in auto_pendientes.values() for item_id in ids]
+    if a_actualizar:
+        db.session.execute(update(ShoppingItem), a_actualizar)
+    if a_insertar:
+        db.session.execute(insert(ShoppingItem), a_insertar)
+    if a_borrar:
+        db.session.execute(ShoppingItem.__table__.delete().where(ShoppingItem.id.in_(a_borrar)))
+    db.session.commit()
+    return len(a_insertar), len(a_actualizar), len(a_borrar)
+
+
+@app.route('/menu/<week_str>/sync_shopping', methods=['POST'])
+@login_required
+def sync_shopping_list(week_str):
+    try:
+        week_start = datetime.strptime(week_str, '%Y-%m-%d').date()
+    except ValueError:
+        flash('Semana no válida.', 'error')
+        return redirect(url_for('menu_semanal_page'))
+
+    try:
+        lista = generar_lista_compra_db(current_user.id, week_start)
+        nuevos, actualizados, borrados = sincronizar_lista_compra(current_user.id, lista)
+        flash(f'Lista de compra actualizada ({nuevos} nuevos, {actualizados} actualizados, {borrados} eliminados).', 'success')
+    except Exception as e:
+        db.session.rollback()
+        print(f"Error sincronizando lista: {e}")
+        flash(f'Error al generar la lista: {e}', 'error')
+    return redirect(url_for('shopping_list'))
+
+
 @app.route('/shopping_list')
 @login_required
 def shopping_list():
@@ -542,6 +922,54 @@ def edit_ingredient(id):
 
     return redirect(url_for('ingredients_manager'))
 
+@app.route('/api/ingredients/bulk_update', methods=['POST'])
+@login_required
+def bulk_update_ingredients():
+    """
+    Actualización de precios/kcal en bloque (tras la compra en el súper).
+    Recibe JSON [{"id": 1, "price_kg": 2.5, "kcal_100g": 120}, ...] y solo
+    recalcula las recetas y semanas que dependen de esos ingredientes.
+    """
+    items = request.get_json(silent=True)
+    if not isinstance(items, list):
+        return jsonify({'error': 'Se esperaba una lista JSON'}), 400
+
+    filas = []
+    try:
+        for item in items:
+            fila = {'id': int(item['id'])}
+            if item.get('price_kg') is not None:
+                fila['price_kg'] = float(item['price_kg'])
+            if item.get('kcal_100g') is not None:
+                fila['kcal_100g'] = float(item['kcal_100g'])
+            if len(fila) > 1:
+                filas.append(fila)
+    except (KeyError, TypeError, ValueError) as e:
+        return jsonify({'error': f'Datos no válidos: {e}'}), 400
+
+    ids = {f['id'] for f in filas}
+    existentes = set(db.session.execute(select(Ingredient.id).where(Ingredient.id.in_(ids))).scalars())
+    if ids - existentes:
+        return jsonify({'error': f'Ingredientes inexistentes: {sorted(ids - existentes)}'}), 400
+
+    try:
+        # Agrupamos por columnas para que cada UPDATE en bloque sea homogéneo
+        por_columnas = {}
+        for f in filas:
+            por_columnas.setdefault(tuple(sorted(f)), []).append(f)
+        for grupo in por_columnas.values():
+            db.session.execute(update(Ingredient), grupo)
+
+        recetas, semanas = propagar_cambios_ingredientes(db.session, ids)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        print(f"Error en actualización en bloque: {e}")
+        return jsonify({'error': str(e)}), 500
+
+    return jsonify({'ingredients': len(ids), 'recipes': len(recetas), 'weeks': len(semanas)})
+
+
 @app.route('/ingredients/delete/<int:id>')
 @login_required
 def delete_ingredient(id):
@@ -586,37 +1014,23 @@ def edit_recipe(id):
         flash('No tienes permiso.', 'error')
         return redirect(url_for('dashboard'))
     
-    # Cargamos ingredientes para el desplegable
-    all_ingredients = Ingredient.query.order_by(Ingredient.name).all()
-
     if request.method == 'POST':
         # 1. Actualizar datos básicos
         receta.title = request.form.get('title')
         receta.description = request.form.get('description')
         receta.steps = request.form.get('steps')
 
-        # 2. Actualizar Ingredientes
-        # Primero borramos los antiguos (es más fácil que comparar uno a uno)
-        # Nota: Al borrar la relación, NO borramos el ingrediente del inventario, solo el vínculo
-        for assoc in receta.ingredients_assoc:
-            db.session.delete(assoc)
-        
-        # Ahora creamos los nuevos vínculos desde el JSON
-        ing_data_json = request.form.get('ingredients_data')
-        if ing_data_json:
-            try:
-                items = json.loads(ing_data_json)
-                for item in items:
-                    assoc = RecipeIngredient(
-                        recipe_id=receta.id,
-                        ingredient_id=int(item['id']),
-                        quantity_g=float(item['qty'])
-                    )
-                    db.session.add(assoc)
-            except Exception as e:
-                print(f"Error: {e}")
+        # 2. Actualizar Ingredientes: solo se tocan los que cambian
+        # Nota: Al quitar la relación, NO borramos el ingrediente del inventario, solo el vínculo
+        try:
+            guardar_ingredientes_receta(receta.id, request.form.get('ingredients_data'))
+            db.session.commit()
+        except ValueError as e:
+            db.session.rollback()
+            print(f"Error: {e}")
+            flash(f'Error al guardar los ingredientes: {e}', 'error')
+            return redirect(url_for('edit_recipe', id=id))
 
-        db.session.commit()
         flash('Receta actualizada.', 'success')
         return redirect(url_for('recetas_page')) # O index/dashboard
 
@@ -641,7 +1055,6 @@ def edit_recipe(id):
 
     # Reutilizamos la plantilla create_recipe.html pero pasándole datos extra
     return render_template('food/create_recipe.html', 
-                           ingredients=all_ingredients, 
                            receta_editar=receta, # Objeto receta
                            preloaded_json=preloaded_json) # JSON para JS
 
@@ -649,7 +1062,7 @@ def edit_recipe(id):
 @login_required
 def gym_dashboard():
     # 1. Sesiones recientes
-    recent_sessions = WorkoutSession.query.filter_by(user_id=current_user.id).order_by(WorkoutSession.date.desc()).limit(5).all()
+    recent_sessions, _ = WorkoutSession.history_page(current_user.id, 5)
     
     # 2. Ejercicios (para el contador del catálogo)
     exercises = Exercise.query.all()
@@ -698,19 +1111,23 @@ def gym_log():
     if routine_id:
         routine = Routine.query.get(routine_id)
         if routine:
+            # Última marca de cada ejercicio de la rutina en una sola lectura (clave primaria)
+            ids = [ex_assoc.exercise_id for ex_assoc in routine.exercises]
+            records = {r.exercise_id: r for r in ExerciseRecord.query.filter(
+                ExerciseRecord.user_id == current_user.id,
+                ExerciseRecord.exercise_id.in_(ids)
+            )}
+
             for ex_assoc in routine.exercises:
                 is_cardio = (ex_assoc.exercise.muscle_group == 'Cardio')
                 
-                # Buscar último registro para sugerir pesos
-                last_set = WorkoutSet.query.join(WorkoutSession).filter(
-                    WorkoutSession.user_id == current_user.id,
-                    WorkoutSet.exercise_id == ex_assoc.exercise_id
-                ).order_by(WorkoutSession.date.desc()).first()
+                # Sugerir pesos a partir del último registro
+                last = records.get(ex_assoc.exercise_id)
                 
-                def_weight = last_set.weight if last_set else ''
-                def_reps = last_set.reps if last_set else ''
-                def_dist = last_set.distance if (last_set and last_set.distance > 0) else (ex_assoc.target_distance if ex_assoc.target_distance else '')
-                def_time = last_set.time if (last_set and last_set.time > 0) else (ex_assoc.target_time if ex_assoc.target_time else '')
+                def_weight = last.last_weight if last else ''
+                def_reps = last.last_reps if last else ''
+                def_dist = last.last_distance if (last and last.last_distance > 0) else (ex_assoc.target_distance if ex_assoc.target_distance else '')
+                def_time = last.last_time if (last and last.last_time > 0) else (ex_assoc.target_time if ex_assoc.target_time else '')
 
                 preloaded_sets.append({
                     'id': str(ex_assoc.exercise_id),
@@ -742,18 +1159,14 @@ def gym_log():
         else:
             final_date = datetime.now()
 
-        # 2. PROCESAR FOTO
-        photo_file = request.files.get('photo')
-        filename = None
-        if photo_file and photo_file.filename != '':
-            fname = secure_filename(photo_file.filename)
-            import time
-            # Añadimos timestamp al nombre para evitar duplicados
-            fname = f"{int(time.time())}_{fname}"
-            photo_file.save(os.path.join(app.root_path, app.config['UPLOAD_FOLDER'], fname))
-            filename = fname
-
         if data_json:
+            # 2. PROCESAR FOTO (se guarda por su hash; las miniaturas se generan en segundo plano)
+            try:
+                filename = foto_del_formulario()
+            except (ValueError, photos.SubidaError) as e:
+                filename = None
+                flash(str(e), 'danger')
+
             try:
                 # Creamos la sesión usando la fecha elegida (final_date)
                 new_session = WorkoutSession(
@@ -778,19 +1191,21 @@ def gym_log():
                     has_cardio = s.get('distance') or s.get('time')
                     
                     if has_strength or has_cardio:
-                        for i in range(num_series):
-                            new_set = WorkoutSet(
-                                session_id=new_session.id,
-                                exercise_id=int(s['id']),
-                                order=index, 
-                                weight=float(s['weight']) if s.get('weight') else 0,
-                                reps=int(s['reps']) if s.get('reps') else 0,
-                                distance=float(s['distance']) if s.get('distance') else 0,
-                                time=int(s['time']) if s.get('time') else 0
-                            )
-                            db.session.add(new_set)
+                        # Las series idénticas se guardan en una sola fila
+                        new_set = WorkoutSet(
+                            session_id=new_session.id,
+                            exercise_id=int(s['id']),
+                            order=index, 
+                            weight=float(s['weight']) if s.get('weight') else 0,
+                            reps=int(s['reps']) if s.get('reps') else 0,
+                            distance=float(s['distance']) if s.get('distance') else 0,
+                            time=int(s['time']) if s.get('time') else 0,
+                            series=max(num_series, 1)
+                        )
+                        db.session.add(new_set)
                 
                 db.session.commit()
+                olvidar_token_del_formulario()
                 flash('Entrenamiento guardado.', 'success')
                 return redirect(url_for('gym_dashboard'))
             except Exception as e:
@@ -806,23 +1221,56 @@ def gym_log():
                            now=datetime.now())
 
 
+SESIONES_POR_PAGINA = 20
+
+
+def _cursor_fecha_id(valor):
+    # "2025-05-25T18:30:00.000000_42" -> (datetime, 42)
+    if not valor:
+        return None
+    try:
+        fecha, sid = valor.rsplit('_', 1)
+        return datetime.strptime(fecha, '%Y-%m-%dT%H:%M:%S.%f'), int(sid)
+    except ValueError:
+        return None
+
+
 @app.route('/gym/history')
 @login_required
 def gym_history():
-    # Obtener todas las sesiones ordenadas por fecha (más reciente primero)
-    sessions = WorkoutSession.query.filter_by(user_id=current_user.id).order_by(WorkoutSession.date.desc()).all()
-    return render_template('gym/history.html', sessions=sessions)
+    # Página de sesiones (más reciente primero) con sus resúmenes en una sola consulta
+    before = _cursor_fecha_id(request.args.get('before'))
+    after = None if before else _cursor_fecha_id(request.args.get('after'))
+    sessions, hay_mas = WorkoutSession.history_page(current_user.id, SESIONES_POR_PAGINA, before=before, after=after)
+
+    def cursor_de(s):
+        return f"{s['date'].strftime('%Y-%m-%dT%H:%M:%S.%f')}_{s['id']}"
+
+    older = newer = None
+    if sessions:
+        if (hay_mas and not after) or after:
+            older = cursor_de(sessions[-1])
+        if (hay_mas and after) or before:
+            newer = cursor_de(sessions[0])
+
+    return render_template('gym/history.html', sessions=sessions, older=older, newer=newer)
 @app.route('/gym/session/<int:id>')
 @login_required
 def gym_session_detail(id):
-    session = WorkoutSession.query.get_or_404(id)
+    # Series y ejercicios de una vez (la plantilla lee ws.exercise en cada fila)
+    session = WorkoutSession.query.options(
+        selectinload(WorkoutSession.sets).joinedload(WorkoutSet.exercise)
+    ).get_or_404(id)
     if session.user_id != current_user.id:
         flash('No tienes permiso.', 'error')
         return redirect(url_for('gym_history'))
-    return render_template('gym/session_detail.html', session=session)
 
-# Asegúrate de importar esto arriba del todo en app.py, o ponlo dentro de la función así:
-from itertools import groupby 
+    # Récords actuales de los ejercicios de la sesión para marcar las series PR
+    records = {r.exercise_id: r for r in ExerciseRecord.query.filter(
+        ExerciseRecord.user_id == current_user.id,
+        ExerciseRecord.exercise_id.in_({s.exercise_id for s in session.sets})
+    )}
+    return render_template('gym/session_detail.html', session=session, records=records)
 
 @app.route('/gym/measurements/delete/<int:id>')
 @login_required
@@ -873,38 +1321,45 @@ def gym_progress(exercise_id):
         flash('No tienes permiso para ver esto.', 'error')
         return redirect(url_for('gym_dashboard'))
     
-    # 1. Obtener historial ordenado por fecha (ASCENDENTE para la gráfica)
+    # La gráfica se pide a /api/gym/progress/<id>; aquí solo las últimas series para la tabla
     history = db.session.query(WorkoutSet, WorkoutSession.date)\
         .join(WorkoutSession)\
-        .filter(WorkoutSet.exercise_id == exercise_id)\
-        .order_by(WorkoutSession.date.asc())\
+        .filter(WorkoutSet.exercise_id == exercise_id, WorkoutSession.user_id == current_user.id)\
+        .order_by(WorkoutSession.date.desc(), WorkoutSet.id.desc())\
+        .limit(30)\
         .all()
     
-    # 2. Preparar datos para Chart.js
-    chart_labels = [] # Eje X: Fechas
-    chart_data = []   # Eje Y: Pesos Máximos
-    
-    # Agrupamos por fecha para sacar el "mejor levantamiento" de cada día
-    # (Nota: groupby requiere que los datos ya vengan ordenados, por eso el .order_by de arriba)
-    for date_obj, group in groupby(history, key=lambda x: x[1].strftime('%Y-%m-%d')):
-        sets_that_day = list(group)
-        # Buscamos el peso máximo levantado ese día
-        max_weight = max([s[0].weight for s in sets_that_day])
-        
-        # Formateamos la fecha para que quede bonita en la gráfica (ej: 25 May)
-        date_label = datetime.strptime(date_obj, '%Y-%m-%d').strftime('%d %b')
-        
-        chart_labels.append(date_label)
-        chart_data.append(max_weight)
-        
-    # 3. Renderizar
-    # Pasamos 'labels' y 'data' que es lo que pide tu HTML y causaba el error
-    return render_template('gym/progress.html', 
-                           exercise=exercise, 
-                           history=reversed(history), # Invertimos para la tabla (lo más nuevo arriba)
-                           labels=chart_labels, 
-                           data=chart_data)
-    
+    return render_template('gym/progress.html', exercise=exercise, history=history)
+
+
+def _fecha_param(nombre):
+    valor = request.args.get(nombre)
+    if not valor:
+        return None
+    try:
+        return datetime.strptime(valor, '%Y-%m-%d')
+    except ValueError:
+        return None
+
+
+@app.route('/api/gym/progress/<int:exercise_id>')
+@login_required
+def api_gym_progress(exercise_id):
+    """Serie diaria agregada en SQL. Parámetros: from, to (YYYY-MM-DD) y max_points."""
+    exercise = Exercise.query.filter_by(id=exercise_id, user_id=current_user.id).first()
+    if not exercise:
+        return jsonify({'error': 'Ejercicio no encontrado'}), 404
+
+    max_points = request.args.get('max_points', 120, type=int)
+    max_points = min(max(max_points, 2), 1000)
+
+    puntos = WorkoutSet.progress_series(
+        current_user.id, exercise_id,
+        desde=_fecha_param('from'), hasta=_fecha_param('to'),
+        max_points=max_points,
+    )
+    return jsonify({'exercise': exercise.name, 'cardio': exercise.is_cardio, 'points': puntos})
+
 @app.route('/gym/routines')
 @login_required
 def gym_routines():
@@ -919,40 +1374,32 @@ def create_routine():
     all_exercises = Exercise.query.order_by(Exercise.name).all()
     
     if request.method == 'POST':
-        new_routine = Routine(
-            name=request.form.get('name'),
-            description=request.form.get('description'),
-            user_id=current_user.id
-        )
-        db.session.add(new_routine)
-        db.session.flush()
-        
-        exercises_json = request.form.get('exercises_data')
-        if exercises_json:
-            try:
-                items = json.loads(exercises_json)
-                for i, item in enumerate(items):
-                    assoc = RoutineExercise(
-                        routine_id=new_routine.id,
-                        exercise_id=int(item['id']),
-                        order=i,
-                        series=int(item.get('series', 1)),
-                        rest_seconds=int(item.get('rest', 60)),
-                        # Nuevos campos
-                        target_distance=float(item.get('distance', 0)),
-                        target_time=int(item.get('time', 0))
-                    )
-                    db.session.add(assoc)
-            except Exception as e:
-                print(e)
-        
-        db.session.commit()
+        try:
+            new_routine = Routine(
+                name=request.form.get('name'),
+                description=request.form.get('description'),
+                user_id=current_user.id
+            )
+            db.session.add(new_routine)
+            db.session.flush()
+
+            guardar_ejercicios_rutina(new_routine.id, request.form.get('exercises_data'), series_por_defecto=1)
+            db.session.commit()
+        except ValueError as e:
+            db.session.rollback()
+            print(e)
+            flash(f'Error al guardar los ejercicios: {e}', 'error')
+            return redirect(url_for('create_routine'))
+
         flash('Rutina creada.', 'success')
         return redirect(url_for('gym_routines'))
 
     return render_template('gym/create_routine.html', form=form, exercises=all_exercises)
 
 
+MEDIDAS_POR_PAGINA = 30
+
+
 @app.route('/gym/measurements', methods=['GET', 'POST'])
 @login_required
 def gym_measurements():
@@ -975,31 +1422,12 @@ def gym_measurements():
         else:
             save_date = datetime.now()
 
-        # 2. Recuperar la medición ANTERIOR a la fecha elegida (para rellenar huecos)
-        # Esto es vital: si registras algo de hace 1 semana, quieres heredar los datos
-        # de hace 2 semanas, no los de ayer.
-        last_measurement = BodyMeasurement.query.filter(
-            BodyMeasurement.user_id == current_user.id,
-            BodyMeasurement.date < save_date
-        ).order_by(BodyMeasurement.date.desc()).first()
-
-        campos = ['weight', 'biceps', 'chest', 'hips', 'thigh', 'calf']
-        datos_para_guardar = {}
-        algun_dato_nuevo = False
-
-        for campo in campos:
-            valor_form = getattr(form, campo).data
-            
-            if valor_form is not None:
-                # Si el usuario escribió algo, lo usamos
-                datos_para_guardar[campo] = valor_form
-                algun_dato_nuevo = True
-            else:
-                # Si está vacío, intentamos heredar del registro anterior
-                if last_measurement:
-                    datos_para_guardar[campo] = getattr(last_measurement, campo)
-                else:
-                    datos_para_guardar[campo] = None
+        # 2. Solo se guarda lo que el usuario ha escrito. Los huecos NO se copian del
+        # registro anterior: el último valor conocido se calcula al leer
+        # (BodyMeasurement.rellenadas), así editar un registro antiguo corrige
+        # también los posteriores.
+        datos_para_guardar = {campo: getattr(form, campo).data for campo in BodyMeasurement.METRICAS}
+        algun_dato_nuevo = any(v is not None for v in datos_para_guardar.values())
 
         # Guardamos solo si hay datos
         if any(datos_para_guardar.values()) and algun_dato_nuevo:
@@ -1027,29 +1455,59 @@ def gym_measurements():
     elif request.method == 'POST':
         flash(f'Error de validación: {form.errors}', 'error')
 
-    # --- PREPARAR DATOS PARA LA GRÁFICA Y TABLA (GET) ---
-    history = BodyMeasurement.query.filter_by(user_id=current_user.id).order_by(BodyMeasurement.date.asc()).all()
-    
-    # Helpers para limpiar nulos en la gráfica
-    def clean_val(val):
-        return val if (val and val > 0) else None
-
-    chart_data = {
-        'labels': [m.date.strftime('%d/%m/%Y') for m in history],
-        'weight': [clean_val(m.weight) for m in history],
-        'biceps': [clean_val(m.biceps) for m in history],
-        'chest':  [clean_val(m.chest) for m in history],
-        'hips':   [clean_val(m.hips) for m in history],
-        'thigh':  [clean_val(m.thigh) for m in history],
-        'calf':   [clean_val(m.calf) for m in history]
-    }
+    # --- TABLA (GET) ---
+    # Solo una página de registros (con los huecos rellenados con el último valor
+    # conocido); la gráfica pide su serie a /api/gym/measurements
+    r = BodyMeasurement.rellenadas(current_user.id)
+    query = select(r)
+    before = _cursor_fecha_id(request.args.get('before'))
+    if before:
+        query = query.where(tuple_(r.c.date, r.c.id) < tuple_(*before))
+    query = query.order_by(r.c.date.desc(), r.c.id.desc()).limit(MEDIDAS_POR_PAGINA + 1)
+    history = db.session.execute(query).all()
+
+    older = None
+    if len(history) > MEDIDAS_POR_PAGINA:
+        history = history[:MEDIDAS_POR_PAGINA]
+        older = f"{history[-1].date.strftime('%Y-%m-%dT%H:%M:%S.%f')}_{history[-1].id}"
 
     return render_template('gym/measurements.html', 
                            form=form, 
-                           history=reversed(history),
-                           chart_data=json.dumps(chart_data),
+                           history=history,
+                           older=older,
                            today_date=today_str) # Pasamos la fecha por defecto
 
+
+@app.route('/api/gym/measurements')
+@login_required
+def api_gym_measurements():
+    """
+    Serie de una medida. Parámetros: metric, from, to (YYYY-MM-DD), bucket=week,
+    rolling=N (media móvil) y max_points (reducción LTTB).
+    """
+    metrica = request.args.get('metric', 'weight')
+    rolling = min(max(request.args.get('rolling', 0, type=int), 0), 60)
+    max_points = min(max(request.args.get('max_points', 200, type=int), 10), 2000)
+    try:
+        puntos = BodyMeasurement.series(
+            current_user.id, metrica,
+            desde=_fecha_param('from'), hasta=_fecha_param('to'),
+            bucket='week' if request.args.get('bucket') == 'week' else None,
+            rolling=rolling, max_points=max_points,
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    # Fecha del primer registro para que la página sepa si hay datos más antiguos que pedir
+    primera = db.session.query(func.min(BodyMeasurement.date)).filter(
+        BodyMeasurement.user_id == current_user.id
+    ).scalar()
+    return jsonify({
+        'metric': metrica,
+        'points': puntos,
+        'first_date': primera.strftime('%Y-%m-%d') if primera else None,
+    })
+
 # --- GESTIÓN DE EJERCICIOS (EDITAR / BORRAR) ---
 
 @app.route('/gym/exercises/delete/<int:id>')
@@ -1133,27 +1591,16 @@ def edit_routine(id):
         rutina.name = request.form.get('name')
         rutina.description = request.form.get('description')
         
-        # Actualizar ejercicios: Borramos los viejos y creamos los nuevos
-        for old_assoc in rutina.exercises:
-            db.session.delete(old_assoc)
-        
-        exercises_json = request.form.get('exercises_data')
-        if exercises_json:
-            try:
-                items = json.loads(exercises_json)
-                for i, item in enumerate(items):
-                    assoc = RoutineExercise(
-                        routine_id=rutina.id,
-                        exercise_id=int(item['id']),
-                        order=i,
-                        series=int(item.get('series', 3)),      # <--- NUEVO
-                        rest_seconds=int(item.get('rest', 60))  # <--- NUEVO
-                    )
-                    db.session.add(assoc)
-            except Exception as e:
-                print(f"Error JSON: {e}")
-        
-        db.session.commit()
+        # Actualizar ejercicios: solo se tocan las posiciones que cambian
+        try:
+            guardar_ejercicios_rutina(rutina.id, request.form.get('exercises_data'), series_por_defecto=3)
+            db.session.commit()
+        except ValueError as e:
+            db.session.rollback()
+            print(f"Error JSON: {e}")
+            flash(f'Error al guardar los ejercicios: {e}', 'error')
+            return redirect(url_for('edit_routine', id=id))
+
         flash('Rutina actualizada correctamente.', 'success')
         return redirect(url_for('gym_routines'))
 
@@ -1164,7 +1611,9 @@ def edit_routine(id):
             'id': str(assoc.exercise_id),
             'name': assoc.exercise.name,
             'series': assoc.series,          # <--- NUEVO
-            'rest': assoc.rest_seconds       # <--- NUEVO
+            'rest': assoc.rest_seconds,      # <--- NUEVO
+            'distance': assoc.target_distance or 0,
+            'time': assoc.target_time or 0
         })
     
     return render_template('gym/create_routine.html', 
@@ -1173,6 +1622,80 @@ def edit_routine(id):
                            rutina_editar=rutina,
                            preloaded_json=json.dumps(preloaded_data))
 
+def carpeta_fotos():
+    return os.path.join(app.root_path, app.config['UPLOAD_FOLDER'])
+
+
+def foto_del_formulario():
+    """
+    Foto enviada con el formulario: o un token de /api/uploads ya completado
+    (photo_token) o, si el navegador no usa la subida por partes, el fichero.
+    """
+    token = request.form.get('photo_token')
+    if token:
+        return photos.resolver_subida(carpeta_fotos(), token, current_user.id)
+    photo_file = request.files.get('photo')
+    if photo_file and photo_file.filename != '':
+        return photos.guardar_foto(photo_file, carpeta_fotos())
+    return None
+
+
+def olvidar_token_del_formulario():
+    # Solo tras el commit: si el guardado falla, el token sigue sirviendo para reintentar
+    token = request.form.get('photo_token')
+    if token:
+        photos.olvidar_subida(carpeta_fotos(), token)
+
+
+@app.errorhandler(413)
+def demasiado_grande(e):
+    if request.path.startswith('/api/'):
+        return jsonify({'error': 'Petición demasiado grande'}), 413
+    flash('El archivo es demasiado grande.', 'danger')
+    return redirect(request.referrer or url_for('gym_dashboard'))
+
+
+def _error_subida(e):
+    cuerpo = {'error': str(e)}
+    if e.offset is not None:
+        cuerpo['offset'] = e.offset
+    return jsonify(cuerpo), e.status
+
+
+@app.route('/api/uploads', methods=['POST'])
+@login_required
+def api_upload_start():
+    """Abre una subida por partes. JSON: {filename, size} -> {token, offset, size, complete}."""
+    datos = request.get_json(silent=True) or {}
+    try:
+        return jsonify(photos.iniciar_subida(carpeta_fotos(), current_user.id, datos.get('filename'), datos.get('size'))), 201
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except photos.SubidaError as e:
+        return _error_subida(e)
+
+
+@app.route('/api/uploads/<token>', methods=['GET', 'PUT'])
+@login_required
+def api_upload_chunk(token):
+    """GET: por dónde va la subida. PUT ?offset=N con el trozo en el cuerpo: lo añade."""
+    try:
+        if request.method == 'GET':
+            return jsonify(photos.estado_subida(carpeta_fotos(), token, current_user.id))
+        offset = request.args.get('offset', type=int)
+        if offset is None:
+            return jsonify({'error': 'Falta el offset'}), 400
+        return jsonify(photos.anadir_parte(carpeta_fotos(), token, current_user.id, offset, request.get_data()))
+    except photos.SubidaError as e:
+        return _error_subida(e)
+
+
+def borrar_foto_si_no_se_usa(filename):
+    # Con nombres por hash varias sesiones pueden compartir el mismo fichero
+    if filename and not WorkoutSession.query.filter_by(photo_filename=filename).first():
+        photos.borrar_foto(carpeta_fotos(), filename)
+
+
 @app.route('/gym/session/delete/<int:id>')
 @login_required
 def delete_workout_session(id):
@@ -1181,18 +1704,13 @@ def delete_workout_session(id):
         flash('No tienes permiso.', 'error')
         return redirect(url_for('gym_history'))
     
-    # 1. Borrar archivo de foto si existe
-    if session.photo_filename:
-        try:
-            file_path = os.path.join(app.root_path, app.config['UPLOAD_FOLDER'], session.photo_filename)
-            if os.path.exists(file_path):
-                os.remove(file_path)
-        except Exception as e:
-            print(f"Error borrando archivo: {e}")
-
-    # 2. Borrar registro (los sets se borran solos por cascade)
+    # 1. Borrar registro (los sets se borran solos por cascade)
+    foto = session.photo_filename
     db.session.delete(session)
     db.session.commit()
+
+    # 2. Borrar archivo de foto si ninguna otra sesión la usa
+    borrar_foto_si_no_se_usa(foto)
     flash('Sesión eliminada correctamente.', 'success')
     return redirect(url_for('gym_history'))
 
@@ -1218,25 +1736,18 @@ def edit_workout_session(id):
                 pass # Si falla, mantenemos la anterior
 
         # --- GESTIÓN DE FOTO (Añadir o Cambiar) ---
-        photo_file = request.files.get('photo')
-        if photo_file and photo_file.filename != '':
-            # 1. Borrar foto vieja si tenía
-            if session.photo_filename:
-                try:
-                    old_path = os.path.join(app.root_path, app.config['UPLOAD_FOLDER'], session.photo_filename)
-                    if os.path.exists(old_path):
-                        os.remove(old_path)
-                except:
-                    pass
-            
-            # 2. Guardar nueva
-            fname = secure_filename(photo_file.filename)
-            import time
-            fname = f"{int(time.time())}_{fname}" # Timestamp único
-            photo_file.save(os.path.join(app.root_path, app.config['UPLOAD_FOLDER'], fname))
-            session.photo_filename = fname
+        foto_vieja = None
+        try:
+            nueva = foto_del_formulario()
+            if nueva and nueva != session.photo_filename:
+                foto_vieja, session.photo_filename = session.photo_filename, nueva
+        except (ValueError, photos.SubidaError) as e:
+            flash(str(e), 'danger')
             
         db.session.commit()
+        olvidar_token_del_formulario()
+        # La foto vieja se borra solo si ya no la usa ninguna sesión
+        borrar_foto_si_no_se_usa(foto_vieja)
         flash('Sesión actualizada.', 'success')
         return redirect(url_for('gym_session_detail', id=session.id))
 
@@ -1263,6 +1774,192 @@ def update_db_schema(app):
                     except Exception as e:
                         print(f"Error: {e}")
 
+        # Índices nuevos en tablas que ya existían (create_all no los añade)
+        fusionar_dias_duplicados()
+        desduplicar_medidas()
+        compactar_series()
+        rellenar_campos_busqueda()
+        for table_name, table_obj in db.metadata.tables.items():
+            if not inspector.has_table(table_name): continue
+            existing_indexes = [idx['name'] for idx in inspector.get_indexes(table_name)]
+            for index in table_obj.indexes:
+                if index.name not in existing_indexes:
+                    print(f"🛠 Creando índice '{index.name}' en '{table_name}'...")
+                    try:
+                        index.create(bind=db.engine)
+                    except Exception as e:
+                        print(f"Error: {e}")
+
+
+def rellenar_campos_busqueda():
+    """Calcula name_search/title_search en filas creadas antes de existir esas columnas."""
+    vacios = (Ingredient.name_search.is_(None)) | (Ingredient.name_search.in_(['', '0']))
+    for ing in Ingredient.query.filter(vacios).all():
+        ing.name_search = normalizar_texto(ing.name)
+
+    vacios = (Receta.title_search.is_(None)) | (Receta.title_search.in_(['', '0']))
+    for receta in Receta.query.filter(vacios).all():
+        receta.title_search = normalizar_texto(receta.title)
+    db.session.commit()
+
+
+def compactar_series():
+    """
+    Junta en una fila (con WorkoutSet.series) las series idénticas de un mismo
+    ejercicio en una sesión, que antes se guardaban como filas repetidas.
+    """
+    # La columna nueva llega con DEFAULT 0: las filas antiguas son una serie cada una
+    db.session.execute(update(WorkoutSet).where((WorkoutSet.series.is_(None)) | (WorkoutSet.series < 1)).values(series=1))
+
+    ws = WorkoutSet.__table__
+    grupo = (ws.c.session_id, ws.c.exercise_id, ws.c.order, ws.c.weight, ws.c.reps, ws.c.distance, ws.c.time)
+    grupos = db.session.execute(
+        select(func.min(ws.c.id).label('keep'), func.sum(ws.c.series).label('total'),
+               func.group_concat(ws.c.id).label('ids'))
+        .group_by(*grupo)
+        .having(func.count(ws.c.id) > 1)
+    ).all()
+    if not grupos:
+        db.session.commit()
+        return
+
+    print(f"🛠 Compactando {len(grupos)} grupos de series repetidas...")
+    sobrantes = [int(i) for g in grupos for i in g.ids.split(',') if int(i) != g.keep]
+    db.session.execute(update(WorkoutSet), [{'id': g.keep, 'series': g.total} for g in grupos])
+    for i in range(0, len(sobrantes), 500):
+        db.session.execute(ws.delete().where(ws.c.id.in_(sobrantes[i:i + 500])))
+    db.session.commit()
+
+
+def desduplicar_medidas():
+    """
+    Antes, al dejar un campo vacío se copiaba el del registro anterior. En las filas
+    antiguas (sparse=False) se borran los valores iguales al último conocido para
+    que la lectura rellenada los recupere. Una fila que se quedaría vacía se deja
+    como está (el usuario repitió todas sus medidas).
+    """
+    # update_db_schema crea la columna con DEFAULT 0 -> todas las filas antiguas
+    pendientes = BodyMeasurement.query.filter(
+        (BodyMeasurement.sparse.is_(None)) | (BodyMeasurement.sparse == False)
+    ).count()
+    if not pendientes:
+        return
+
+    print(f"🛠 Quitando valores copiados de {pendientes} medidas antiguas...")
+    cambios = []
+    user_ids = db.session.execute(select(BodyMeasurement.user_id).distinct()).scalars().all()
+    for user_id in user_ids:
+        conocido = {}
+        filas = BodyMeasurement.query.filter_by(user_id=user_id)\
+            .order_by(BodyMeasurement.date, BodyMeasurement.id).all()
+        for m in filas:
+            valores = {campo: getattr(m, campo) for campo in BodyMeasurement.METRICAS}
+            cambio = {'id': m.id, 'sparse': True}
+            if not m.sparse:
+                copiados = {c: None for c, v in valores.items() if v is not None and conocido.get(c) == v}
+                if len(copiados) < sum(v is not None for v in valores.values()):
+                    cambio.update(copiados)
+                cambios.append(cambio)
+            conocido.update({c: v for c, v in valores.items() if v is not None})
+
+    db.session.execute(update(BodyMeasurement), cambios)
+    db.session.commit()
+
+
+def fusionar_dias_duplicados():
+    """
+    Deja un único MenuSemanal por (usuario, semana, día) antes de crear el índice único.
+    Se conserva el más antiguo, que es el que mostraba la app (.first()).
+    """
+    duplicados = db.session.execute(text('''
+        SELECT m.id FROM menu_semanal m
+        WHERE m.id NOT IN (
+            SELECT MIN(id) FROM menu_semanal GROUP BY user_id, week_start, dia
+        )
+    ''')).scalars().all()
+    if not duplicados:
+        return
+
+    print(f"🛠 Eliminando {len(duplicados)} días de menú duplicados...")
+    db.session.execute(MenuSelection.__table__.delete().where(MenuSelection.menu_id.in_(duplicados)))
+    db.session.execute(MenuSemanal.__table__.delete().where(MenuSemanal.id.in_(duplicados)))
+    db.session.commit()
+
+
+@app.cli.command('check-recipe-stats')
+@click.option('--fix', is_flag=True, help='Reescribe los totales que no cuadren.')
+def check_recipe_stats(fix):
+    """Compara Receta.kcal/precio guardados con el cálculo real y avisa de desvíos."""
+    recetas = Receta.query.options(
+        selectinload(Receta.ingredients_assoc).selectinload(RecipeIngredient.ingredient)
+    ).all()
+
+    drift = []
+    for r in recetas:
+        real = r.compute_stats()
+        guardado = r.total_stats
+        # Margen de redondeo: SQLite y Python no redondean igual los x.xx5
+        cuadra = abs(real['kcal'] - guardado['kcal']) <= 1 and abs(real['price'] - guardado['price']) <= 0.011
+        if not cuadra or len(r.ingredients_assoc) != (r.n_ingredientes or 0):
+            drift.append(r.id)
+            print(f"❌ Receta {r.id} '{r.title}': guardado {guardado} / real {real}")
+
+    print(f"{len(recetas)} recetas revisadas, {len(drift)} con desvío.")
+    if drift and fix:
+        refresh_recipe_stats(db.session.connection(), drift)
+        db.session.commit()
+        print(f"🛠 {len(drift)} recetas recalculadas.")
+
+
+@app.cli.command('sweep-uploads')
+@click.option('--dry-run', is_flag=True, help='Solo lista lo que se borraría.')
+@click.option('--min-age', default=3600, help='No toca ficheros más nuevos que estos segundos.')
+def sweep_uploads(dry_run, min_age):
+    """Borra de static/uploads las fotos (y miniaturas) que no usa ninguna sesión."""
+    usadas = db.session.execute(
+        select(WorkoutSession.photo_filename).where(WorkoutSession.photo_filename.isnot(None)).distinct()
+    ).scalars().all()
+    borrados = photos.barrer_huerfanos(carpeta_fotos(), usadas, margen_segundos=min_age, dry_run=dry_run)
+    for ruta in borrados:
+        print(f"{'·' if dry_run else '🗑'} {os.path.relpath(ruta, app.root_path)}")
+    print(f"{len(borrados)} ficheros huérfanos{' (sin borrar)' if dry_run else ' borrados'}.")
+
+
+@app.cli.command('build-thumbnails')
+def build_thumbnails():
+    """Genera las miniaturas que falten (fotos subidas antes de existir la cola)."""
+    if photos.Image is None:
+        print("Pillow no está instalado: no se pueden generar miniaturas.")
+        return
+    usadas = db.session.execute(
+        select(WorkoutSession.photo_filename).where(WorkoutSession.photo_filename.isnot(None)).distinct()
+    ).scalars().all()
+    total = sum(photos.generar_variantes(carpeta_fotos(), f) for f in usadas)
+    print(f"{total} miniaturas generadas.")
+
+
+@app.cli.command('check-session-calories')
+@click.option('--fix', is_flag=True, help='Reescribe los totales que no cuadren.')
+def check_session_calories(fix):
+    """Compara WorkoutSession.kcal guardado con el cálculo real y avisa de desvíos."""
+    sesiones = WorkoutSession.query.options(
+        selectinload(WorkoutSession.sets).joinedload(WorkoutSet.exercise)
+    ).all()
+
+    drift = []
+    for s in sesiones:
+        real = s.compute_calories()
+        # Margen de redondeo: SQLite y Python no redondean igual los x.5
+        if abs(real - s.total_calories) > 1:
+            drift.append(s.id)
+            print(f"❌ Sesión {s.id} ({s.date:%d/%m/%Y}): guardado {s.total_calories} / real {real}")
+
+    print(f"{len(sesiones)} sesiones revisadas, {len(drift)} con desvío.")
+    if drift and fix:
+        refresh_session_calories(db.session.connection(), drift)
+        db.session.commit()
+        print(f"🛠 {len(drift)} sesiones recalculadas.")
+
 
 @app.route('/admin/users')
 @login_required
@@ -1275,6 +1972,41 @@ def admin_users():
     users = User.query.all()
     return render_template('admin/users.html', users=users)
 
+# MÉTRICAS PARA PROMETHEUS (ver metrics.py). Con METRICS_TOKEN definido pide
+# 'Authorization: Bearer <token>'; sin él queda abierta (Prometheus no inicia sesión)
+@app.route('/metrics')
+def metrics_endpoint():
+    token = os.environ.get('METRICS_TOKEN')
+    if token and request.headers.get('Authorization') != f'Bearer {token}':
+        abort(401)
+    return Response(metrics.exponer(app.config.get('METRICS_DIR')), mimetype='text/plain; version=0.0.4')
+
+# PERFILES GUARDADOS (ver profiler.py: ?_profile=1 en cualquier página)
+@app.route('/admin/profiles')
+@login_required
+def admin_profiles():
+    if not current_user.is_admin:
+        flash('Acceso denegado. Se requieren permisos de administrador.', 'danger')
+        return redirect(url_for('dashboard'))
+
+    ver = request.args.get('ver')
+    orden = request.args.get('orden', 'cumulative')
+    if orden not in ('cumulative', 'tottime', 'ncalls'):
+        orden = 'cumulative'
+    detalle = profiler.resumen(ver, orden) if ver else None
+    return render_template('admin/profiles.html', perfiles=profiler.listar(), ver=ver, orden=orden,
+                           detalle=detalle, tasa=app.config.get('PROFILE_SAMPLE_RATE'))
+
+@app.route('/admin/profiles/<nombre>')
+@login_required
+def download_profile(nombre):
+    if not current_user.is_admin:
+        return redirect(url_for('dashboard'))
+    ruta = profiler.ruta_fichero(nombre)
+    if ruta is None:
+        abort(404)
+    return send_file(ruta, as_attachment=True, download_name=nombre)
+
 # 2. ELIMINAR USUARIO
 @app.route('/admin/users/delete/<int:id>')
 @login_required
@@ -1424,7 +2156,19 @@ if __name__ == '__main__':
     # 2. EJECUTAR EL CORRECTOR DINÁMICO (Tu nueva función)
     print("Iniciando chequeo de base de datos...")
     update_db_schema(app)
+
+    # 3. Rellenar los totales de recetas y sesiones creadas antes de guardarlos en la tabla
+    with app.app_context():
+        refresh_recipe_stats(db.session.connection())
+        refresh_session_calories(db.session.connection())
+        db.session.commit()
+    
+    # 4. Construir la tabla de récords si aún está vacía
+    with app.app_context():
+        if not ExerciseRecord.query.first():
+            refresh_exercise_records(db.session.connection())
+            db.session.commit()
     
-    # 3. Arrancar servidor
+    # 5. Arrancar servidor
     print("Iniciando Home OS Multi-User en puerto 5003...")
     app.run(debug=True, port=5003)
\ No newline at end of file
@@ -0,0 +1,185 @@
+"""
+Mide cada ruta con el cliente de pruebas de Flask sobre una BD sembrada con seed.py.
+
+    python seed.py --db bench.db                           # una vez
+    python benchmark.py --db bench.db --save               # guarda la referencia
+    python benchmark.py --db bench.db                      # compara con la referencia
+
+Por ruta: p50/p95 de latencia, número de consultas SQL y pico de memoria
+(tracemalloc, en una pasada aparte para no inflar los tiempos). Sale con
+código 1 si alguna ruta empeora respecto a la referencia guardada.
+"""
+import argparse
+import gc
+import json
+import os
+import statistics
+import sys
+import time
+import tracemalloc
+from datetime import date, timedelta
+
+import sqlstats
+
+# Empeora si supera la referencia en este factor Y en este margen absoluto (ruido).
+# El p95 se enseña pero no cuenta: con pocas repeticiones es sobre todo ruido.
+TOLERANCIA = 1.25
+MARGEN_MS = 2.0
+MARGEN_KB = 256
+
+
+def rutas(ids):
+    semana = (date.today() - timedelta(days=date.today().weekday())).isoformat()
+    return [
+        '/',
+        '/recetas',
+        '/recetas?sort=kcal&dir=desc',
+        '/ingredients',
+        '/api/search/ingredients?q=pollo',
+        '/api/search/recipes?q=arroz',
+        f'/menu/{semana}',
+        '/shopping_list',
+        f"/edit_recipe/{ids['receta']}",
+        '/gym',
+        '/gym/exercises',
+        '/gym/history',
+        f"/gym/session/{ids['sesion']}",
+        f"/gym/session/edit/{ids['sesion']}",
+        f"/gym/log?routine_id={ids['rutina']}",
+        f"/gym/progress/{ids['ejercicio']}",
+        f"/api/gym/progress/{ids['ejercicio']}",
+        '/gym/routines',
+        f"/gym/routines/edit/{ids['rutina']}",
+        '/gym/measurements',
+        '/api/gym/measurements?metric=weight&rolling=7',
+    ]
+
+
+def ids_de_ejemplo(db, models, user_id):
+    """Un objeto de cada tipo del usuario para rellenar las rutas con parámetros."""
+    def ultimo(modelo, *filtros):
+        fila = db.session.query(modelo.id).filter(*filtros).order_by(modelo.id.desc()).first()
+        if fila is None:
+            raise SystemExit(f"El usuario {user_id} no tiene {modelo.__tablename__}: siembra antes con seed.py")
+        return fila[0]
+
+    return {
+        'receta': ultimo(models.Receta, models.Receta.user_id == user_id),
+        'sesion': ultimo(models.WorkoutSession, models.WorkoutSession.user_id == user_id),
+        'rutina': ultimo(models.Routine, models.Routine.user_id == user_id),
+        # El ejercicio con más historial es el caso caro de /gym/progress
+        'ejercicio': db.session.query(models.ExerciseRecord.exercise_id)
+                       .filter_by(user_id=user_id).order_by(models.ExerciseRecord.best_weight.desc()).first()[0],
+    }
+
+
+def percentil(valores, p):
+    orden = sorted(valores)
+    k = (len(orden) - 1) * p
+    i = int(k)
+    return orden[i] if i + 1 >= len(orden) else orden[i] + (orden[i + 1] - orden[i]) * (k - i)
+
+
+def medir(app, user_id, url, repeticiones):
+    client = app.test_client()
+    with client.session_transaction() as s:
+        s['_user_id'] = str(user_id)
+        s['_fresh'] = True
+
+    status = client.get(url).status_code  # Calentamiento (plantillas, cachés)
+    gc.collect()
+    tiempos = []
+    for _ in range(repeticiones):
+        with sqlstats.contar() as stats:
+            t0 = time.perf_counter()
+            client.get(url)
+            tiempos.append((time.perf_counter() - t0) * 1000)
+    consultas = stats.consultas
+
+    tracemalloc.start()
+    client.get(url)
+    _, pico = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {'status': status, 'p50_ms': round(statistics.median(tiempos), 2),
+            'p95_ms': round(percentil(tiempos, 0.95), 2), 'consultas': consultas,
+            'pico_kb': round(pico / 1024)}
+
+
+def regresiones(actual, referencia):
+    """Lista de textos con lo que ha empeorado de una ruta."""
+    malas = []
+    for clave, margen in (('p50_ms', MARGEN_MS), ('pico_kb', MARGEN_KB)):
+        antes, ahora = referencia.get(clave), actual[clave]
+        if antes is not None and ahora > antes * TOLERANCIA and ahora - antes > margen:
+            malas.append(f"{clave} {antes} -> {ahora}")
+    if referencia.get('consultas') is not None and actual['consultas'] > referencia['consultas']:
+        malas.append(f"consultas {referencia['consultas']} -> {actual['consultas']}")
+    return malas
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--db', default='bench.db', help='BD sembrada con seed.py.')
+    parser.add_argument('--user', default=None, help='Usuario con el que medir (por defecto el primer demoN).')
+    parser.add_argument('-n', '--repeat', type=int, default=20, help='Peticiones medidas por ruta.')
+    parser.add_argument('--baseline', default='benchmark_baseline.json')
+    parser.add_argument('--save', action='store_true', help='Guarda estos resultados como referencia.')
+    parser.add_argument('--only', default=None, help='Solo las rutas que contengan este texto.')
+    args = parser.parse_args(argv)
+
+    if not os.path.exists(args.db):
+        print(f"No existe {args.db}: créala con python seed.py --db {args.db}")
+        return 2
+    os.environ['DATABASE_URL'] = f"sqlite:///{os.path.abspath(args.db)}"
+
+    import models
+    from app import app, db
+
+    app.config['WTF_CSRF_ENABLED'] = False
+    app.config['ACCESS_LOG'] = False
+
+    with app.app_context():
+        filtro = models.User.username == args.user if args.user else models.User.username.like('demo%')
+        user = models.User.query.filter(filtro).order_by(models.User.id).first()
+        if user is None:
+            print("No hay usuario con el que medir: siembra antes con seed.py")
+            return 2
+        user_id = user.id
+        lista = rutas(ids_de_ejemplo(db, models, user_id))
+
+    if args.only:
+        lista = [url for url in lista if args.only in url]
+
+    referencia = {}
+    if os.path.exists(args.baseline) and not args.save:
+        with open(args.baseline) as f:
+            referencia = json.load(f).get('rutas', {})
+
+    resultados = {}
+    peores = 0
+    print(f"{'ruta':48} {'p50 ms':>8} {'p95 ms':>8} {'SQL':>5} {'pico KB':>8}")
+    for url in lista:
+        r = medir(app, user_id, url, args.repeat)
+        resultados[url] = r
+        malas = regresiones(r, referencia[url]) if url in referencia else []
+        marca = ' ✗ ' + ', '.join(malas) if malas else ''
+        if r['status'] >= 400:
+            marca += f" (HTTP {r['status']})"
+        print(f"{url[:48]:48} {r['p50_ms']:8.2f} {r['p95_ms']:8.2f} {r['consultas']:5} {r['pico_kb']:8}{marca}")
+        peores += bool(malas) or r['status'] >= 400
+
+    if args.save:
+        with open(args.baseline, 'w') as f:
+            json.dump({'db': os.path.basename(args.db), 'repeticiones': args.repeat, 'rutas': resultados}, f, indent=2)
+        print(f"\nReferencia guardada en {args.baseline}")
+        return 0
+
+    if not referencia:
+        print(f"\nSin referencia ({args.baseline}): ejecuta con --save para crearla.")
+    print(f"\n{len(lista)} rutas medidas, {peores} empeoran o fallan.")
+    return 1 if peores else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,194 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextlib import closing, contextmanager
+
+import metrics
+from models import MenuSemanal, on_users_changed, on_weeks_changed, today_snapshot
+
+
+# --- ALMACENES ---
+# Misma interfaz (get / set / delete) para poder cambiar uno por otro.
+
+class LRUStore:
+    """Caché en memoria del proceso. Se pierde al reiniciar y no se comparte entre workers."""
+
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            if key not in self._data:
+                return None
+            self._data.move_to_end(key)
+            return self._data[key]
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+
+class SQLiteStore:
+    """
+    Caché en un fichero SQLite aparte, compartido por todos los procesos
+    (gunicorn con varios workers). Los valores se guardan como JSON.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with self._connect() as conn:
+            # WAL queda guardado en el fichero: basta con pedirlo una vez
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value TEXT, updated REAL)')
+
+    @contextmanager
+    def _connect(self):
+        # "with sqlite3.connect()" solo hace commit/rollback, no cierra la conexión
+        with closing(sqlite3.connect(self.path, timeout=5)) as conn:
+            with conn:
+                yield conn
+
+    def get(self, key):
+        with self._connect() as conn:
+            row = conn.execute('SELECT value FROM cache WHERE key = ?', (key,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def set(self, key, value):
+        with self._connect() as conn:
+            conn.execute('INSERT OR REPLACE INTO cache (key, value, updated) VALUES (?, ?, ?)',
+                         (key, json.dumps(value), time.time()))
+
+    def delete(self, key):
+        with self._connect() as conn:
+            conn.execute('DELETE FROM cache WHERE key = ?', (key,))
+
+
+def store_from_url(url):
+    """'lru' / 'lru://2048' -> LRUStore ; 'sqlite:///ruta/cache.db' -> SQLiteStore."""
+    if not url or url.startswith('lru'):
+        size = url.split('://', 1)[1] if url and '://' in url else ''
+        return LRUStore(int(size) if size else 1024)
+    if url.startswith('sqlite:///'):
+        return SQLiteStore(url[len('sqlite:///'):])
+    raise ValueError(f"Caché no soportada: {url}")
+
+
+# --- RESUMEN SEMANAL (kcal/precio por día y total) ---
+
+class WeekSummaryCache:
+    """
+    Guarda MenuSemanal.week_summary por (usuario, semana). Se invalida desde los
+    eventos de SQLAlchemy de models.py (MenuSelection, RecipeIngredient, Ingredient).
+    """
+
+    def __init__(self, store=None):
+        self.store = store or LRUStore()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _key(user_id, week_start):
+        week = week_start.isoformat() if hasattr(week_start, 'isoformat') else str(week_start)
+        return f"week:{user_id}:{week}"
+
+    def get(self, user_id, week_start):
+        key = self._key(user_id, week_start)
+        resumen = self.store.get(key)
+        if resumen is not None:
+            self.hits += 1
+            return resumen
+
+        self.misses += 1
+        resumen = MenuSemanal.week_summary(user_id, week_start)
+        self.store.set(key, resumen)
+        return resumen
+
+    def invalidate(self, user_id, week_start):
+        self.store.delete(self._key(user_id, week_start))
+
+    def invalidate_many(self, semanas):
+        for user_id, week_start in semanas:
+            self.invalidate(user_id, week_start)
+
+
+week_cache = WeekSummaryCache()
+
+
+@on_weeks_changed
+def _invalidate_weeks(semanas):
+    week_cache.invalidate_many(semanas)
+
+
+# --- RESUMEN DE HOY (dashboard) ---
+
+class TodaySnapshotCache:
+    """
+    Guarda models.today_snapshot por usuario. Lleva la fecha dentro: al cambiar
+    de día se recalcula solo. Se invalida cuando cambian menú, sesiones, medidas
+    o perfil del usuario.
+    """
+
+    def __init__(self, store=None):
+        self.store = store or LRUStore()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _key(user_id):
+        return f"today:{user_id}"
+
+    def get(self, user_id, hoy):
+        key = self._key(user_id)
+        snapshot = self.store.get(key)
+        if snapshot is not None and snapshot.get('fecha') == hoy.isoformat():
+            self.hits += 1
+            return snapshot
+
+        self.misses += 1
+        snapshot = today_snapshot(user_id, hoy)
+        self.store.set(key, snapshot)
+        return snapshot
+
+    def invalidate(self, user_id):
+        self.store.delete(self._key(user_id))
+
+
+today_cache = TodaySnapshotCache()
+
+
+@on_weeks_changed
+def _invalidate_today_by_week(semanas):
+    for user_id, _ in semanas:
+        today_cache.invalidate(user_id)
+
+
+@on_users_changed
+def _invalidate_today(user_ids):
+    for user_id in user_ids:
+        today_cache.invalidate(user_id)
+
+
+@metrics.colector
+def _metricas_caches():
+    return [('cache_requests_total', {'cache': nombre, 'resultado': resultado}, valor)
+            for nombre, c in (('week', week_cache), ('today', today_cache))
+            for resultado, valor in (('hit', c.hits), ('miss', c.misses))]
+
+
+def init_app(app):
+    # WEEK_CACHE_URL: 'lru' (por defecto) o 'sqlite:///ruta' para compartir entre procesos
+    url = app.config.get('WEEK_CACHE_URL') or os.environ.get('WEEK_CACHE_URL')
+    week_cache.store = store_from_url(url)
+    today_cache.store = week_cache.store  # Claves distintas ('week:' / 'today:'), mismo almacén
@@ -0,0 +1,354 @@
+import atexit
+import itertools
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+import weakref
+
+from flask import current_app, g, request
+
+
+# --- CONTADORES POR PROCESO ---
+# Cada hilo escribe en sus propios diccionarios (sin locks en el camino de la
+# petición); al exponer se suman los de todos los hilos. Con varios workers
+# (gunicorn) cada proceso vuelca lo suyo desde un hilo en METRICS_DIR/<pid>.json
+# y /metrics suma todos los ficheros, como el modo multiproceso de prometheus_client.
+# METRICS_DIR hay que vaciarlo al arrancar el servicio.
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+VOLCADO_SEGUNDOS = 5
+
+AYUDA = {
+    'http_request_duration_seconds': ('histogram', 'Duración de las peticiones por endpoint, método y estado.'),
+    'http_request_db_seconds_total': ('counter', 'Tiempo en la base de datos por endpoint.'),
+    'http_db_time_share': ('gauge', 'Fracción del tiempo de las peticiones que se va en la base de datos.'),
+    'uploads_bytes_written_total': ('counter', 'Bytes escritos en static/uploads (originales, trozos y miniaturas).'),
+    'cache_requests_total': ('counter', 'Consultas a las cachés de resúmenes por resultado (hit/miss).'),
+    'cache_hit_ratio': ('gauge', 'Aciertos / consultas de cada caché.'),
+}
+
+_local = threading.local()
+_por_hilo = {}  # hilo vivo -> (contadores, histogramas)
+_ids_hilo = itertools.count()
+# Lo de los hilos que ya terminaron (Werkzeug abre uno por petición) se suma a
+# _cerrados para que _por_hilo no crezca sin límite. Al morir el hilo solo se
+# apunta en _muertos; la suma se hace al exponer o al arrancar otro hilo.
+_cerrados = ({}, {})
+_muertos = []
+_lock_cerrados = threading.Lock()
+_colectores = []
+_carpeta_volcado = [None]  # METRICS_DIR una vez arrancado el hilo de volcado
+
+
+def _mios():
+    if not hasattr(_local, 'datos'):
+        clave = next(_ids_hilo)
+        _local.datos = _por_hilo[clave] = ({}, {})
+        weakref.finalize(threading.current_thread(), _muertos.append, clave)
+        # Recogida oportunista; si otro hilo tiene el lock, ya lo hará él
+        if _muertos and _lock_cerrados.acquire(blocking=False):
+            try:
+                _recoger()
+            finally:
+                _lock_cerrados.release()
+    return _local.datos
+
+
+def _sumar(destino, origen):
+    contadores, histogramas = destino
+    for clave, valor in dict(origen[0]).items():
+        contadores[clave] = contadores.get(clave, 0) + valor
+    for clave, valores in dict(origen[1]).items():
+        actual = histogramas.setdefault(clave, [0] * len(valores))
+        for i, v in enumerate(list(valores)):
+            actual[i] += v
+
+
+def _recoger():
+    # Con _lock_cerrados tomado. El finalize puede saltar en mitad de cualquier
+    # código (recolector), por eso allí solo se hace un append y no se bloquea
+    while _muertos:
+        datos = _por_hilo.pop(_muertos.pop(), None)
+        if datos is not None:
+            _sumar(_cerrados, datos)
+
+
+def _clave(nombre, labels):
+    return nombre, tuple(sorted(labels.items()))
+
+
+def inc(nombre, valor=1, **labels):
+    """Suma valor a un contador."""
+    contadores = _mios()[0]
+    clave = _clave(nombre, labels)
+    contadores[clave] = contadores.get(clave, 0) + valor
+
+
+def observar(nombre, valor, **labels):
+    """Anota una observación en un histograma (BUCKETS)."""
+    histogramas = _mios()[1]
+    clave = _clave(nombre, labels)
+    h = histogramas.get(clave)
+    if h is None:
+        h = histogramas[clave] = [0] * len(BUCKETS) + [0.0, 0]  # cubos..., suma, cuenta
+    for i, limite in enumerate(BUCKETS):
+        if valor <= limite:
+            h[i] += 1
+            break
+    h[-2] += valor
+    h[-1] += 1
+
+
+def colector(fn):
+    """
+    Registra una función que devuelve contadores ya acumulados en otro sitio,
+    como [(nombre, {labels}, valor), ...]. Se lee al volcar o exponer.
+    """
+    _colectores.append(fn)
+    return fn
+
+
+def instantanea():
+    """Lo de este proceso: {'contadores': [...], 'histogramas': [...]} serializable."""
+    contadores, histogramas = {}, {}
+    with _lock_cerrados:
+        _recoger()
+        for datos in [_cerrados] + list(_por_hilo.values()):
+            _sumar((contadores, histogramas), datos)
+    for fn in _colectores:
+        for nombre, labels, valor in fn():
+            clave = _clave(nombre, labels)
+            contadores[clave] = contadores.get(clave, 0) + valor
+    return {
+        'contadores': [[n, list(l), v] for (n, l), v in contadores.items()],
+        'histogramas': [[n, list(l), v] for (n, l), v in histogramas.items()],
+    }
+
+
+def volcar(carpeta):
+    """Escribe la instantánea del proceso en carpeta/<pid>.json (reemplazo atómico)."""
+    os.makedirs(carpeta, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=carpeta, suffix='.tmp')
+    with os.fdopen(fd, 'w') as f:
+        json.dump(instantanea(), f)
+    os.replace(tmp, os.path.join(carpeta, f"{os.getpid()}.json"))
+
+
+def _volcar_sin_fallar():
+    try:
+        volcar(_carpeta_volcado[0])
+    except OSError as e:
+        print(f"Error volcando métricas: {e}")
+
+
+def _bucle_volcado():
+    while True:
+        time.sleep(VOLCADO_SEGUNDOS)
+        _volcar_sin_fallar()
+
+
+def _arrancar_volcador():
+    threading.Thread(target=_bucle_volcado, name='metricas-volcado', daemon=True).start()
+
+
+def _tras_fork():
+    # El fork no copia hilos: si el volcador tenía el lock, en el hijo no lo
+    # soltaría nadie. Lock nuevo y volcador propio para cada worker
+    global _lock_cerrados
+    _lock_cerrados = threading.Lock()
+    _arrancar_volcador()
+
+
+def empezar_volcado(carpeta):
+    """
+    Vuelca en un hilo aparte cada VOLCADO_SEGUNDOS y una última vez al salir,
+    para que un worker ocioso no se quede con sus últimas cuentas sin escribir.
+    Así la petición no escribe ficheros ni toma _lock_cerrados.
+    """
+    if _carpeta_volcado[0] is not None:
+        return
+    _carpeta_volcado[0] = carpeta
+    _arrancar_volcador()
+    atexit.register(_volcar_sin_fallar)
+    if hasattr(os, 'register_at_fork'):  # gunicorn --preload (no existe en Windows)
+        os.register_at_fork(after_in_child=_tras_fork)
+
+
+def agregado(carpeta=None):
+    """Suma la instantánea propia con las de los demás procesos de carpeta."""
+    fuentes = [instantanea()]
+    if carpeta and os.path.isdir(carpeta):
+        propio = f"{os.getpid()}.json"
+        for nombre in os.listdir(carpeta):
+            if not nombre.endswith('.json') or nombre == propio:
+                continue
+            try:
+                with open(os.path.join(carpeta, nombre)) as f:
+                    fuentes.append(json.load(f))
+            except (OSError, ValueError) as e:
+                print(f"Error leyendo métricas de {nombre}: {e}")
+
+    contadores, histogramas = {}, {}
+    for fuente in fuentes:
+        for n, l, v in fuente['contadores']:
+            clave = (n, tuple(tuple(par) for par in l))
+            contadores[clave] = contadores.get(clave, 0) + v
+        for n, l, v in fuente['histogramas']:
+            clave = (n, tuple(tuple(par) for par in l))
+            actual = histogramas.setdefault(clave, [0] * len(v))
+            for i, x in enumerate(v):
+                actual[i] += x
+    return contadores, histogramas
+
+
+# --- FORMATO PROMETHEUS ---
+
+def _labels(pares):
+    if not pares:
+        return ''
+    escapar = lambda v: str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return '{' + ','.join(f'{k}="{escapar(v)}"' for k, v in pares) + '}'
+
+
+def _derivadas(contadores, histogramas):
+    """Gauges que se calculan al exponer: reparto de tiempo en BD y tasa de aciertos."""
+    gauges = {}
+    total_por_endpoint = {}
+    for (n, l), h in histogramas.items():
+        if n == 'http_request_duration_seconds':
+            endpoint = dict(l).get('endpoint')
+            total_por_endpoint[endpoint] = total_por_endpoint.get(endpoint, 0) + h[-2]
+    for (n, l), v in contadores.items():
+        if n == 'http_request_db_seconds_total':
+            endpoint = dict(l).get('endpoint')
+            if total_por_endpoint.get(endpoint):
+                gauges[('http_db_time_share', l)] = v / total_por_endpoint[endpoint]
+
+    por_cache = {}
+    for (n, l), v in contadores.items():
+        if n == 'cache_requests_total':
+            d = dict(l)
+            por_cache.setdefault(d['cache'], {}).update({d['resultado']: v})
+    for cache, r in por_cache.items():
+        total = r.get('hit', 0) + r.get('miss', 0)
+        if total:
+            gauges[('cache_hit_ratio', (('cache', cache),))] = r.get('hit', 0) / total
+    return gauges
+
+
+def exponer(carpeta=None):
+    """Texto en formato de exposición de Prometheus (version 0.0.4)."""
+    contadores, histogramas = agregado(carpeta)
+    gauges = _derivadas(contadores, histogramas)
+    lineas = []
+    vistos = set()
+
+    def cabecera(nombre, tipo):
+        if nombre not in vistos:
+            vistos.add(nombre)
+            tipo, ayuda = AYUDA.get(nombre, (tipo, nombre))
+            lineas.append(f"# HELP {nombre} {ayuda}")
+            lineas.append(f"# TYPE {nombre} {tipo}")
+
+    for (n, l), h in sorted(histogramas.items()):
+        cabecera(n, 'histogram')
+        acumulado = 0
+        for limite, cuenta in zip(BUCKETS, h):
+            acumulado += cuenta
+            lineas.append(f"{n}_bucket{_labels(l + (('le', repr(float(limite))),))} {acumulado}")
+        lineas.append(f"{n}_bucket{_labels(l + (('le', '+Inf'),))} {h[-1]}")
+        lineas.append(f"{n}_sum{_labels(l)} {h[-2]:.6f}")
+        lineas.append(f"{n}_count{_labels(l)} {h[-1]}")
+    for (n, l), v in sorted(contadores.items()):
+        cabecera(n, 'counter')
+        lineas.append(f"{n}{_labels(l)} {v:.6f}" if isinstance(v, float) else f"{n}{_labels(l)} {v}")
+    for (n, l), v in sorted(gauges.items()):
+        cabecera(n, 'gauge')
+        lineas.append(f"{n}{_labels(l)} {v:.4f}")
+    return '\n'.join(lineas) + '\n'
+
+
+# --- INTEGRACIÓN CON FLASK ---
+
+access_log = logging.getLogger('homeos.access')
+
+
+def _inicio():
+    g.metricas_inicio = time.perf_counter()
+
+
+def _fin(response):
+    inicio = g.pop('metricas_inicio', None)
+    if inicio is None:
+        return response
+    duracion = time.perf_counter() - inicio
+    endpoint = request.endpoint or 'sin_ruta'
+    estado = str(response.status_code)
+
+    observar('http_request_duration_seconds', duracion, endpoint=endpoint, method=request.method, status=estado)
+    # sqlstats corre después (after_request va en orden inverso): sus datos siguen en g
+    stats = g.get('sql_stats')
+    if stats is not None:
+        inc('http_request_db_seconds_total', stats.tiempo, endpoint=endpoint)
+
+    if current_app.config.get('ACCESS_LOG', True):
+        from flask_login import current_user
+        access_log.info(json.dumps({
+            'ts': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'method': request.method, 'path': request.path, 'endpoint': endpoint,
+            'status': response.status_code, 'ms': round(duracion * 1000, 2),
+            'db_ms': round(stats.tiempo * 1000, 2) if stats else None,
+            'queries': stats.consultas if stats else None,
+            'bytes': response.calculate_content_length(),
+            'user_id': current_user.get_id() if current_user else None,
+            'ip': request.remote_addr,
+        }, ensure_ascii=False))
+    return response
+
+
+def init_app(app):
+    # METRICS_DIR: carpeta compartida por los workers para sumar sus métricas
+    app.config.setdefault('METRICS_DIR', os.environ.get('METRICS_DIR'))
+    # ACCESS_LOG=0 desactiva el log de accesos en JSON (una línea por petición)
+    app.config.setdefault('ACCESS_LOG', os.environ.get('ACCESS_LOG', '1') == '1')
+    if not access_log.handlers:
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        access_log.addHandler(handler)
+        access_log.setLevel(logging.INFO)
+        access_log.propagate = False
+    if app.config['METRICS_DIR']:
+        empezar_volcado(app.config['METRICS_DIR'])
+    app.before_request(_inicio)
+    app.after_request(_fin)
+
+
+# --- COMPROBACIÓN: python metrics.py ---
+# Muchos hilos cortos (como el servidor de desarrollo, uno por petición) no deben
+# dejar rastro en _por_hilo y sus cuentas tienen que seguir sumando.
+
+if __name__ == '__main__':
+    import gc
+    import sys
+
+    N = 1000
+
+    def _peticion():
+        inc('comprobacion_total')
+        observar('comprobacion_seconds', 0.01)
+
+    for _ in range(N):
+        hilo = threading.Thread(target=_peticion)
+        hilo.start()
+        hilo.join()
+    gc.collect()
+
+    datos = instantanea()
+    total = sum(v for n, _, v in datos['contadores'] if n == 'comprobacion_total')
+    cuenta = sum(v[-1] for n, _, v in datos['histogramas'] if n == 'comprobacion_seconds')
+    vivos = len(_por_hilo)
+    print(f"{N} hilos: {vivos} en _por_hilo, contador {total}, histograma {cuenta}")
+    sys.exit(0 if vivos <= 1 and total == N and cuenta == N else 1)
@@ -1,10 +1,20 @@
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import UserMixin
 from werkzeug.security import generate_password_hash, check_password_hash
-from datetime import datetime
+from datetime import datetime, timedelta
+import unicodedata
+from sqlalchemy import case, event, func, or_, select, tuple_, update
+from sqlalchemy.orm import Session, joinedload, selectinload, validates
+from sqlalchemy.orm.attributes import get_history
 
 db = SQLAlchemy()
 
+
+def normalizar_texto(texto):
+    # Minúsculas y sin tildes: "Plátano" -> "platano" (para búsquedas)
+    texto = unicodedata.normalize('NFKD', texto or '')
+    return ''.join(c for c in texto if not unicodedata.combining(c)).lower().strip()
+
 # --- USUARIO ---
 class User(UserMixin, db.Model):
     __tablename__ = 'user'
@@ -56,14 +66,24 @@ class User(UserMixin, db.Model):
 class Ingredient(db.Model):
     __tablename__ = 'ingredient'
     id = db.Column(db.Integer, primary_key=True)
-    name = db.Column(db.String(100), nullable=False)
+    name = db.Column(db.String(100), nullable=False, index=True)
     kcal_100g = db.Column(db.Float, nullable=False)
     price_kg = db.Column(db.Float, nullable=False)
+    name_search = db.Column(db.String(100), index=True) # Nombre normalizado para el autocompletado
     
     recipes_assoc = db.relationship("RecipeIngredient", back_populates="ingredient", cascade="all, delete-orphan")
 
+    @validates('name')
+    def _sync_name_search(self, key, value):
+        self.name_search = normalizar_texto(value)
+        return value
+
 class RecipeIngredient(db.Model):
     __tablename__ = 'recipe_ingredients'
+    __table_args__ = (
+        # La PK empieza por recipe_id; para ir de ingrediente -> recetas hace falta este
+        db.Index('ix_recipe_ingredients_ingredient', 'ingredient_id', 'recipe_id'),
+    )
     recipe_id = db.Column(db.Integer, db.ForeignKey('recipe.id'), primary_key=True)
     ingredient_id = db.Column(db.Integer, db.ForeignKey('ingredient.id'), primary_key=True)
     quantity_g = db.Column(db.Float, nullable=False)
@@ -74,18 +94,37 @@ class RecipeIngredient(db.Model):
 # --- RECETAS ---
 class Receta(db.Model):
     __tablename__ = 'recipe'
+    __table_args__ = (
+        # Índices para paginar/ordenar el recetario de cada usuario (keyset)
+        db.Index('ix_recipe_user_title', 'user_id', 'title_search', 'id'),
+        db.Index('ix_recipe_user_kcal', 'user_id', 'kcal', 'id'),
+        db.Index('ix_recipe_user_precio', 'user_id', 'precio', 'id'),
+        db.Index('ix_recipe_user_n_ingredientes', 'user_id', 'n_ingredientes', 'id'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(100), nullable=False)
     description = db.Column(db.Text)
     steps = db.Column(db.Text)
     kcal = db.Column(db.Float, default=0)
     precio = db.Column(db.Float, default=0.0)
+    n_ingredientes = db.Column(db.Integer, default=0)
+    title_search = db.Column(db.String(100), index=True) # Título normalizado para el autocompletado
     
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     ingredients_assoc = db.relationship("RecipeIngredient", back_populates="recipe", cascade="all, delete-orphan")
 
+    @validates('title')
+    def _sync_title_search(self, key, value):
+        self.title_search = normalizar_texto(value)
+        return value
+
     @property
     def total_stats(self):
+        # Lee los totales guardados (los mantiene al día refresh_recipe_stats)
+        return {'kcal': round(self.kcal or 0), 'price': round(self.precio or 0, 2)}
+
+    def compute_stats(self):
+        # Cálculo "en vivo" recorriendo los ingredientes (solo para comprobar/reparar)
         try:
             k = sum([(i.quantity_g / 100) * i.ingredient.kcal_100g for i in self.ingredients_assoc])
             p = sum([(i.quantity_g / 1000) * i.ingredient.price_kg for i in self.ingredients_assoc])
@@ -93,19 +132,106 @@ class Receta(db.Model):
         except:
             return {'kcal': 0, 'price': 0}
 
+
+def refresh_recipe_stats(connection, recipe_ids=None):
+    """
+    Recalcula Receta.kcal, Receta.precio y Receta.n_ingredientes en un único
+    UPDATE con subconsultas. Si recipe_ids es None se recalculan todas las recetas.
+    """
+    ri = RecipeIngredient.__table__
+    ing = Ingredient.__table__
+    recipe = Receta.__table__
+
+    def _sum(expr):
+        return func.coalesce(
+            select(func.sum(expr))
+            .select_from(ri.join(ing, ing.c.id == ri.c.ingredient_id))
+            .where(ri.c.recipe_id == recipe.c.id)
+            .scalar_subquery(), 0)
+
+    stmt = update(recipe).values(
+        kcal=func.round(_sum(ri.c.quantity_g / 100.0 * ing.c.kcal_100g)),
+        precio=func.round(_sum(ri.c.quantity_g / 1000.0 * ing.c.price_kg), 2),
+        n_ingredientes=_sum(1)
+    )
+    if recipe_ids is not None:
+        if not recipe_ids:
+            return
+        stmt = stmt.where(recipe.c.id.in_(recipe_ids))
+    connection.execute(stmt)
+
+
 # --- MENU SEMANAL ---
 class MenuSemanal(db.Model):
     __tablename__ = 'menu_semanal'
+    __table_args__ = (
+        # Un único registro por usuario, semana y día
+        db.Index('uq_menu_semanal_user_week_dia', 'user_id', 'week_start', 'dia', unique=True),
+    )
     id = db.Column(db.Integer, primary_key=True)
     dia = db.Column(db.String(20))
     week_start = db.Column(db.Date, nullable=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     
-    selecciones = db.relationship('MenuSelection', backref='menu_dia', lazy='dynamic', cascade="all, delete-orphan")
+    selecciones = db.relationship('MenuSelection', backref='menu_dia', lazy=True, cascade="all, delete-orphan")
 
     def get_selections(self, tipo):
         if self.id is None: return []
-        return self.selecciones.filter_by(tipo_comida=tipo).all()
+        # Filtramos en memoria: si la semana viene de load_week no hay consultas extra
+        return [s for s in self.selecciones if s.tipo_comida == tipo]
+
+    @classmethod
+    def load_week(cls, user_id, week_start):
+        """
+        Carga los días de una semana con sus selecciones, recetas e ingredientes
+        en un número fijo de consultas (los totales de receta ya están guardados). Devuelve un dict {dia: MenuSemanal}.
+        """
+        dias = cls.query.filter_by(user_id=user_id, week_start=week_start).options(
+            selectinload(cls.selecciones).options(
+                joinedload(MenuSelection.receta),
+                joinedload(MenuSelection.ingredient)
+            )
+        ).order_by(cls.id).all()
+
+        semana = {}
+        for d in dias:
+            semana.setdefault(d.dia, d) # Si hubiera duplicados, nos quedamos con el primero
+        return semana
+
+    @classmethod
+    def week_summary(cls, user_id, week_start):
+        """
+        Totales de kcal/precio por día y de la semana en una sola consulta
+        agrupada (usa los totales guardados de cada receta).
+        """
+        ms = MenuSelection.__table__
+        menu = cls.__table__
+        recipe = Receta.__table__
+        ing = Ingredient.__table__
+
+        es_receta = ms.c.receta_id.isnot(None)
+        kcal = func.sum(case((es_receta, recipe.c.kcal), else_=ms.c.quantity / 100.0 * ing.c.kcal_100g))
+        price = func.sum(case((es_receta, recipe.c.precio), else_=ms.c.quantity / 1000.0 * ing.c.price_kg))
+
+        rows = db.session.execute(
+            select(menu.c.dia, kcal.label('kcal'), price.label('price'))
+            .select_from(
+                ms.join(menu, menu.c.id == ms.c.menu_id)
+                  .outerjoin(recipe, recipe.c.id == ms.c.receta_id)
+                  .outerjoin(ing, ing.c.id == ms.c.ingredient_id)
+            )
+            .where(menu.c.user_id == user_id, menu.c.week_start == week_start)
+            .group_by(menu.c.dia)
+        )
+
+        dias = {}
+        for row in rows:
+            dias[row.dia] = {'kcal': round(row.kcal or 0), 'price': round(row.price or 0, 2)}
+        total = {
+            'kcal': sum(d['kcal'] for d in dias.values()),
+            'price': round(sum(d['price'] for d in dias.values()), 2)
+        }
+        return {'dias': dias, 'total': total}
 
     @property
     def daily_stats(self):
@@ -123,6 +249,13 @@ class MenuSemanal(db.Model):
 
 class MenuSelection(db.Model):
     __tablename__ = 'menu_selection'
+    __table_args__ = (
+        # Para saber qué menús usan una receta o un ingrediente suelto
+        db.Index('ix_menu_selection_receta', 'receta_id', 'menu_id'),
+        db.Index('ix_menu_selection_ingredient', 'ingredient_id', 'menu_id'),
+        # Cargar las selecciones de unos días (selectinload / joins desde menu_semanal)
+        db.Index('ix_menu_selection_menu_tipo', 'menu_id', 'tipo_comida'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     menu_id = db.Column(db.Integer, db.ForeignKey('menu_semanal.id'), nullable=False)
     tipo_comida = db.Column(db.String(20))
@@ -132,9 +265,168 @@ class MenuSelection(db.Model):
     ingredient = db.relationship('Ingredient')
     quantity = db.Column(db.Float, default=0.0)
 
+# --- PROPAGACIÓN DE CAMBIOS (INGREDIENTE -> RECETAS -> SEMANAS) ---
+# Tras cada flush miramos qué recetas se han visto afectadas (cambios en sus
+# RecipeIngredient o en kcal/precio de un Ingredient), las recalculamos en SQL
+# y avisamos de qué semanas de menú dependen de ellas.
+
+# Funciones fn(semanas) a las que se avisa cuando cambian los totales de unas
+# semanas; semanas es un set de (user_id, week_start).
+week_change_handlers = []
+
+
+def on_weeks_changed(fn):
+    week_change_handlers.append(fn)
+    return fn
+
+
+def notify_weeks_changed(session, semanas):
+    """
+    Avisa ya (para lecturas dentro de la misma transacción) y otra vez tras el
+    commit, por si otro proceso recalculó con los datos viejos mientras tanto.
+    """
+    if not semanas:
+        return
+    for fn in week_change_handlers:
+        fn(semanas)
+    session.info.setdefault('weeks_changed', set()).update(semanas)
+
+
+@event.listens_for(Session, 'after_commit')
+def _notify_weeks_after_commit(session):
+    semanas = session.info.pop('weeks_changed', None)
+    if semanas:
+        for fn in week_change_handlers:
+            fn(semanas)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_weeks_after_rollback(session):
+    session.info.pop('weeks_changed', None)
+
+
+def dependientes_de_ingredientes(connection, ingredient_ids):
+    """
+    Índice inverso sobre las FK indexadas: devuelve las recetas que usan esos
+    ingredientes y las semanas (user_id, week_start) que usan esas recetas o
+    los ingredientes sueltos. Son dos consultas, sin recorrer el catálogo.
+    """
+    if not ingredient_ids:
+        return set(), set()
+    ri = RecipeIngredient.__table__
+    recipe_ids = set(connection.execute(
+        select(ri.c.recipe_id).where(ri.c.ingredient_id.in_(ingredient_ids))
+    ).scalars())
+    return recipe_ids, semanas_de(connection, recipe_ids, ingredient_ids)
+
+
+def semanas_de(connection, recipe_ids=(), ingredient_ids=(), menu_ids=()):
+    """Semanas (user_id, week_start) con alguna de esas recetas, ingredientes sueltos o días de menú."""
+    ms = MenuSelection.__table__
+    menu = MenuSemanal.__table__
+    if menu_ids and not recipe_ids and not ingredient_ids:
+        rows = connection.execute(
+            select(menu.c.user_id, menu.c.week_start).distinct().where(menu.c.id.in_(menu_ids))
+        )
+        return {(r.user_id, r.week_start) for r in rows}
+
+    conds = []
+    if recipe_ids:
+        conds.append(ms.c.receta_id.in_(recipe_ids))
+    if ingredient_ids:
+        conds.append(ms.c.ingredient_id.in_(ingredient_ids))
+    if menu_ids:
+        conds.append(ms.c.menu_id.in_(menu_ids))
+    if not conds:
+        return set()
+    rows = connection.execute(
+        select(menu.c.user_id, menu.c.week_start).distinct()
+        .select_from(ms.join(menu, menu.c.id == ms.c.menu_id))
+        .where(or_(*conds))
+    )
+    return {(r.user_id, r.week_start) for r in rows}
+
+
+def propagar_cambios_ingredientes(session, ingredient_ids):
+    """
+    Para cambios de kcal/precio hechos fuera del ORM (p.ej. actualizaciones en bloque):
+    recalcula solo las recetas afectadas y avisa a las semanas que dependen de ellas.
+    """
+    connection = session.connection()
+    recipe_ids, semanas = dependientes_de_ingredientes(connection, ingredient_ids)
+    refresh_recipe_stats(connection, recipe_ids)
+    notify_weeks_changed(session, semanas)
+    return recipe_ids, semanas
+
+
+def propagar_cambios_recetas(session, recipe_ids):
+    """Igual que arriba pero partiendo de recetas cuyos RecipeIngredient se cambiaron en bloque."""
+    connection = session.connection()
+    refresh_recipe_stats(connection, recipe_ids)
+    notify_weeks_changed(session, semanas_de(connection, recipe_ids))
+    for obj in list(session.identity_map.values()):
+        if isinstance(obj, Receta) and obj.id in recipe_ids:
+            session.expire(obj, ['kcal', 'precio', 'n_ingredientes', 'ingredients_assoc'])
+
+
+@event.listens_for(Session, 'after_flush')
+def _collect_dirty_recipes(session, flush_context):
+    recipe_ids = session.info.setdefault('recipes_to_refresh', set())
+    ingredient_ids = session.info.setdefault('ingredients_to_refresh', set())
+    menu_ids = session.info.setdefault('menus_to_refresh', set())
+    semanas = session.info.setdefault('weeks_to_refresh', set())
+
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, MenuSemanal):
+            semanas.add((obj.user_id, obj.week_start))
+        elif isinstance(obj, MenuSelection):
+            if obj.menu_id is not None:
+                menu_ids.add(obj.menu_id)
+        elif isinstance(obj, RecipeIngredient):
+            if obj.recipe_id is not None:
+                recipe_ids.add(obj.recipe_id)
+        elif isinstance(obj, Receta):
+            # Al borrarla, los MenuSelection que la apuntan siguen ahí: sus semanas cambian
+            if obj in session.deleted or (obj.id is not None and get_history(obj, 'ingredients_assoc').has_changes()):
+                recipe_ids.add(obj.id)
+        elif isinstance(obj, Ingredient) and obj in session.deleted:
+            ingredient_ids.add(obj.id)  # Puede seguir suelto en algún menú
+        elif isinstance(obj, Ingredient) and obj in session.dirty:
+            if get_history(obj, 'kcal_100g').has_changes() or get_history(obj, 'price_kg').has_changes():
+                ingredient_ids.add(obj.id)
+
+
+@event.listens_for(Session, 'after_flush_postexec')
+def _refresh_dirty_recipes(session, flush_context):
+    recipe_ids = session.info.pop('recipes_to_refresh', set())
+    ingredient_ids = session.info.pop('ingredients_to_refresh', set())
+    menu_ids = session.info.pop('menus_to_refresh', set())
+    semanas = session.info.pop('weeks_to_refresh', set())
+    if not (recipe_ids or ingredient_ids or menu_ids or semanas):
+        return
+
+    connection = session.connection()
+    recetas_ing, semanas_ing = dependientes_de_ingredientes(connection, ingredient_ids)
+    semanas |= semanas_ing
+    semanas |= semanas_de(connection, recipe_ids - recetas_ing)
+    semanas |= semanas_de(connection, menu_ids=menu_ids)
+    recipe_ids |= recetas_ing
+
+    refresh_recipe_stats(connection, recipe_ids)
+    notify_weeks_changed(session, semanas)
+
+    # Las instancias ya cargadas tienen los valores viejos: los caducamos
+    for obj in list(session.identity_map.values()):
+        if isinstance(obj, Receta) and obj.id in recipe_ids:
+            session.expire(obj, ['kcal', 'precio', 'n_ingredientes'])
+
+
 # --- OTROS ---
 class TareaLimpieza(db.Model):
     __tablename__ = 'tarea_limpieza'
+    __table_args__ = (
+        db.Index('ix_tarea_limpieza_user', 'user_id', 'proxima_fecha'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     nombre = db.Column(db.String(100), nullable=False)
     asignado_a = db.Column(db.String(50))
@@ -145,6 +437,9 @@ class TareaLimpieza(db.Model):
 
 class Lavadora(db.Model):
     __tablename__ = 'lavadora'
+    __table_args__ = (
+        db.Index('ix_lavadora_user', 'user_id'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     tipo = db.Column(db.String(50))
     dia_preferente = db.Column(db.String(20))
@@ -153,6 +448,9 @@ class Lavadora(db.Model):
 
 class ShoppingItem(db.Model):
     __tablename__ = 'shopping_item'
+    __table_args__ = (
+        db.Index('ix_shopping_item_user', 'user_id', 'completed', 'nombre'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     nombre = db.Column(db.String(100), nullable=False)
     cantidad = db.Column(db.Float, default=1.0)
@@ -164,6 +462,10 @@ class ShoppingItem(db.Model):
 # --- GYM ---
 class Exercise(db.Model):
     __tablename__ = 'exercise'
+    __table_args__ = (
+        db.Index('ix_exercise_user_name', 'user_id', 'name'),
+        db.Index('ix_exercise_group_name', 'muscle_group', 'name'),  # Catálogo ordenado
+    )
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), nullable=False)
     muscle_group = db.Column(db.String(50)) 
@@ -183,26 +485,111 @@ class Exercise(db.Model):
 
 class WorkoutSession(db.Model):
     __tablename__ = 'workout_session'
+    __table_args__ = (
+        db.Index('ix_workout_session_user_date', 'user_id', 'date', 'id'),
+        db.Index('ix_workout_session_photo', 'photo_filename'),  # ¿Alguien más usa esta foto?
+    )
     id = db.Column(db.Integer, primary_key=True)
     date = db.Column(db.DateTime, default=datetime.utcnow)
     note = db.Column(db.String(200))
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     photo_filename = db.Column(db.String(255), nullable=True)
+    # Kcal quemadas guardadas (las recalcula refresh_session_calories al cambiar series o ejercicios)
+    kcal = db.Column(db.Integer, default=0)
     sets = db.relationship('WorkoutSet', backref='session', cascade="all, delete-orphan", lazy=True)
 
+    @classmethod
+    def history_page(cls, user_id, limit, before=None, after=None):
+        """
+        Una página del historial (más recientes primero) con el resumen de cada
+        sesión -ejercicios, nº de series y kcal- calculado en una sola consulta
+        agrupada. 'before'/'after' son cursores (date, id) para paginar por keyset.
+        Devuelve (filas, hay_mas) donde cada fila es un dict con las mismas claves
+        que usan las plantillas (summary, total_calories, n_sets...).
+        """
+        ses = cls.__table__
+        ws = WorkoutSet.__table__
+        ex = Exercise.__table__
+
+        # 1. Las sesiones de la página (índice user_id, date, id)
+        pagina = select(ses).where(ses.c.user_id == user_id)
+        if before:
+            pagina = pagina.where(tuple_(ses.c.date, ses.c.id) < tuple_(*before))
+        elif after:
+            pagina = pagina.where(tuple_(ses.c.date, ses.c.id) > tuple_(*after))
+        if after:
+            pagina = pagina.order_by(ses.c.date.asc(), ses.c.id.asc())
+        else:
+            pagina = pagina.order_by(ses.c.date.desc(), ses.c.id.desc())
+        pagina = pagina.limit(limit + 1).subquery('pagina')
+
+        # 2. Nº de series por sesión (las kcal ya vienen guardadas en la sesión)
+        totales = (
+            select(ws.c.session_id, func.sum(ws.c.series).label('n_sets'))
+            .where(ws.c.session_id.in_(select(pagina.c.id)))
+            .group_by(ws.c.session_id)
+            .subquery('totales')
+        )
+
+        # 3. Nombres de ejercicio distintos por sesión
+        distintos = (
+            select(ws.c.session_id, ex.c.name).distinct()
+            .select_from(ws.join(ex, ex.c.id == ws.c.exercise_id))
+            .where(ws.c.session_id.in_(select(pagina.c.id)))
+            .subquery('distintos')
+        )
+        nombres = (
+            select(distintos.c.session_id, func.group_concat(distintos.c.name, ', ').label('summary'))
+            .group_by(distintos.c.session_id)
+            .subquery('nombres')
+        )
+
+        stmt = (
+            select(pagina, totales.c.n_sets, nombres.c.summary)
+            .select_from(
+                pagina.outerjoin(totales, totales.c.session_id == pagina.c.id)
+                      .outerjoin(nombres, nombres.c.session_id == pagina.c.id)
+            )
+            .order_by(*((pagina.c.date.asc(), pagina.c.id.asc()) if after else (pagina.c.date.desc(), pagina.c.id.desc())))
+        )
+
+        filas = [{
+            'id': r.id,
+            'date': r.date,
+            'note': r.note,
+            'photo_filename': r.photo_filename,
+            'summary': r.summary or '',
+            'n_sets': r.n_sets or 0,
+            'total_calories': round(r.kcal or 0)
+        } for r in db.session.execute(stmt)]
+
+        hay_mas = len(filas) > limit
+        filas = filas[:limit]
+        if after:
+            filas.reverse()
+        return filas, hay_mas
+
     @property
     def summary(self):
         exercises = set([s.exercise.name for s in self.sets])
         return ", ".join(exercises)
     @property
     def total_calories(self):
+        return self.kcal or 0
+
+    def compute_calories(self):
+        """Cálculo en vivo (recorre las series). Solo para comprobar el valor guardado."""
         total = 0
         for s in self.sets:
-            total += s.est_calories
+            total += s.est_calories * (s.series or 1)
         return round(total)
 
 class WorkoutSet(db.Model):
     __tablename__ = 'workout_set'
+    __table_args__ = (
+        db.Index('ix_workout_set_session', 'session_id'),
+        db.Index('ix_workout_set_exercise_session', 'exercise_id', 'session_id'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     session_id = db.Column(db.Integer, db.ForeignKey('workout_session.id'), nullable=False)
     exercise_id = db.Column(db.Integer, db.ForeignKey('exercise.id'), nullable=False)
@@ -211,6 +598,71 @@ class WorkoutSet(db.Model):
     distance = db.Column(db.Float, default=0.0)
     time = db.Column(db.Integer, default=0)
     order = db.Column(db.Integer, default=1)
+    # Nº de series idénticas que representa esta fila (5x5 = una fila con series=5)
+    series = db.Column(db.Integer, default=1)
+
+    @classmethod
+    def progress_series(cls, user_id, exercise_id, desde=None, hasta=None, max_points=None):
+        """
+        Serie diaria de un ejercicio calculada en SQL: peso máximo, 1RM estimado
+        (Epley: peso * (1 + reps/30)), volumen (peso * reps), distancia y tiempo.
+        Con max_points se agrupan días consecutivos en como mucho ese número de
+        puntos (NTILE), quedándose con el máximo de peso/1RM y la media del resto.
+        """
+        dia = func.date(WorkoutSession.date)
+        filtros = [WorkoutSession.user_id == user_id, cls.exercise_id == exercise_id]
+        if desde:
+            filtros.append(WorkoutSession.date >= desde)
+        if hasta:
+            filtros.append(WorkoutSession.date < hasta + timedelta(days=1))
+
+        diario = (
+            select(
+                dia.label('dia'),
+                func.max(cls.weight).label('max_weight'),
+                func.max(cls.weight * (1 + cls.reps / 30.0)).label('one_rm'),
+                func.sum(cls.weight * cls.reps * cls.series).label('volume'),
+                func.sum(cls.distance * cls.series).label('distance'),
+                func.sum(cls.time * cls.series).label('time'),
+                func.sum(cls.series).label('n_sets'),
+            )
+            .join(WorkoutSession, WorkoutSession.id == cls.session_id)
+            .where(*filtros)
+            .group_by(dia)
+        )
+
+        if max_points:
+            d = diario.subquery('diario')
+            tramo = select(d, func.ntile(max_points).over(order_by=d.c.dia).label('tramo')).subquery('tramos')
+            consulta = (
+                select(
+                    func.max(tramo.c.dia).label('dia'),
+                    func.max(tramo.c.max_weight).label('max_weight'),
+                    func.max(tramo.c.one_rm).label('one_rm'),
+                    func.avg(tramo.c.volume).label('volume'),
+                    func.avg(tramo.c.distance).label('distance'),
+                    func.avg(tramo.c.time).label('time'),
+                    func.sum(tramo.c.n_sets).label('n_sets'),
+                )
+                .group_by(tramo.c.tramo)
+                .order_by(func.max(tramo.c.dia))
+            )
+        else:
+            consulta = diario.order_by(dia)
+
+        return [
+            {
+                'date': r.dia,
+                'max_weight': r.max_weight or 0,
+                'one_rm': round(r.one_rm or 0, 1),
+                'volume': round(r.volume or 0, 1),
+                'distance': round(r.distance or 0, 2),
+                'time': round(r.time or 0, 1),
+                'n_sets': r.n_sets,
+            }
+            for r in db.session.execute(consulta)
+        ]
+
     @property
     def est_calories(self):
         rate = self.exercise.burn_rate or 0
@@ -221,16 +673,56 @@ class WorkoutSet(db.Model):
             # Fuerza: Tasa * Repeticiones
             return rate * (self.reps or 0)
 
+class ExerciseRecord(db.Model):
+    """
+    Última marca y mejores marcas de cada usuario en cada ejercicio. No se escribe a
+    mano: la mantienen los eventos de sesión de abajo (ver refresh_exercise_records).
+    """
+    __tablename__ = 'exercise_record'
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    exercise_id = db.Column(db.Integer, db.ForeignKey('exercise.id'), primary_key=True)
+
+    # Última serie registrada (para precargar rutinas)
+    last_session_id = db.Column(db.Integer)
+    last_date = db.Column(db.DateTime)
+    last_weight = db.Column(db.Float, default=0)
+    last_reps = db.Column(db.Integer, default=0)
+    last_distance = db.Column(db.Float, default=0.0)
+    last_time = db.Column(db.Integer, default=0)
+
+    # Récords personales
+    best_weight = db.Column(db.Float, default=0)
+    best_reps = db.Column(db.Integer, default=0)
+    best_one_rm = db.Column(db.Float, default=0)
+    best_distance = db.Column(db.Float, default=0.0)
+    best_time = db.Column(db.Integer, default=0)
+
+    def is_pr(self, workout_set):
+        """True si la serie iguala algún récord (peso, 1RM o distancia)."""
+        if workout_set.weight and workout_set.weight >= (self.best_weight or 0):
+            return True
+        if workout_set.weight and workout_set.reps:
+            one_rm = workout_set.weight * (1 + workout_set.reps / 30.0)
+            if round(one_rm, 6) >= round(self.best_one_rm or 0, 6):
+                return True
+        return bool(workout_set.distance) and workout_set.distance >= (self.best_distance or 0)
+
 class Routine(db.Model):
     __tablename__ = 'routine'
+    __table_args__ = (
+        db.Index('ix_routine_user', 'user_id'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), nullable=False)
     description = db.Column(db.String(200))
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
-    exercises = db.relationship('RoutineExercise', backref='routine', cascade="all, delete-orphan", lazy=True)
+    exercises = db.relationship('RoutineExercise', backref='routine', cascade="all, delete-orphan", lazy=True, order_by='RoutineExercise.order')
 
 class RoutineExercise(db.Model):
     __tablename__ = 'routine_exercise'
+    __table_args__ = (
+        db.Index('ix_routine_exercise_routine', 'routine_id', 'order'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     routine_id = db.Column(db.Integer, db.ForeignKey('routine.id'), nullable=False)
     exercise_id = db.Column(db.Integer, db.ForeignKey('exercise.id'), nullable=False)
@@ -244,6 +736,11 @@ class RoutineExercise(db.Model):
 
 class BodyMeasurement(db.Model):
     __tablename__ = 'body_measurement'
+    __table_args__ = (
+        db.Index('ix_body_measurement_user_date', 'user_id', 'date', 'id'),
+    )
+    METRICAS = ('weight', 'biceps', 'chest', 'hips', 'thigh', 'calf')
+
     id = db.Column(db.Integer, primary_key=True)
     date = db.Column(db.DateTime, default=datetime.utcnow)
     weight = db.Column(db.Float)
@@ -252,4 +749,479 @@ class BodyMeasurement(db.Model):
     hips = db.Column(db.Float)
     thigh = db.Column(db.Float)
     calf = db.Column(db.Float)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
\ No newline at end of file
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    # Solo se guardan los valores introducidos; lo demás se rellena al leer (ver rellenadas).
+    # False = fila antigua que aún puede llevar valores copiados del registro anterior.
+    sparse = db.Column(db.Boolean, default=True)
+
+    @classmethod
+    def rellenadas(cls, user_id):
+        """
+        Subconsulta con las medidas del usuario y cada campo rellenado con el último
+        valor conocido a esa fecha. SQLite no tiene IGNORE NULLS, así que se cuenta
+        cuántos valores ha habido hasta cada fila (grupo) y dentro de cada grupo
+        solo la primera fila tiene valor: MAX sobre el grupo lo reparte.
+        Incluye también los valores tal cual (raw_<campo>) para saber cuáles se escribieron.
+        """
+        orden = (cls.date, cls.id)
+        grupos = select(
+            cls.id, cls.date, cls.user_id,
+            *[getattr(cls, m) for m in cls.METRICAS],
+            *[func.count(getattr(cls, m)).over(order_by=orden).label(f'g_{m}') for m in cls.METRICAS],
+        ).where(cls.user_id == user_id).subquery('grupos')
+
+        return select(
+            grupos.c.id, grupos.c.date, grupos.c.user_id,
+            *[func.max(grupos.c[m]).over(partition_by=grupos.c[f'g_{m}']).label(m) for m in cls.METRICAS],
+            *[grupos.c[m].label(f'raw_{m}') for m in cls.METRICAS],
+        ).subquery('rellenadas')
+
+    @classmethod
+    def latest_as_of(cls, user_id, fecha=None):
+        """Último valor conocido de cada medida antes de 'fecha' (o a día de hoy). {} si no hay."""
+        r = cls.rellenadas(user_id)
+        consulta = select(r)
+        if fecha:
+            consulta = consulta.where(r.c.date < fecha)
+        fila = db.session.execute(consulta.order_by(r.c.date.desc(), r.c.id.desc()).limit(1)).first()
+        return {m: getattr(fila, m) for m in cls.METRICAS} if fila else {}
+
+    @classmethod
+    def first_known(cls, user_id):
+        """Primer valor registrado de cada medida, en una sola consulta."""
+        def primero(col):
+            return (select(col).where(cls.user_id == user_id, col.isnot(None))
+                    .order_by(cls.date, cls.id).limit(1).scalar_subquery())
+        fila = db.session.execute(select(*[primero(getattr(cls, m)).label(m) for m in cls.METRICAS])).first()
+        return {m: getattr(fila, m) for m in cls.METRICAS}
+
+    @classmethod
+    def series(cls, user_id, metrica, desde=None, hasta=None, bucket=None, rolling=None, max_points=None):
+        """
+        Serie de una medida entre dos fechas. Los ceros y nulos no son medidas.
+        - bucket='week': una media por semana, agrupada en SQL.
+        - rolling=N: media móvil de las N últimas medidas (ventana SQL; cuenta
+          también las anteriores a 'desde' para que el principio no salga cojo).
+        - max_points: si aún quedan más puntos, se reducen con LTTB.
+        Devuelve una lista de dicts {date, value[, avg]}.
+        """
+        if metrica not in cls.METRICAS:
+            raise ValueError(f"Medida no válida: {metrica}")
+        col = getattr(cls, metrica)
+
+        if bucket == 'week':
+            fecha = func.min(func.date(cls.date))
+            valor = func.avg(col)
+            base = (
+                select(fecha.label('fecha'), valor.label('valor'))
+                .where(cls.user_id == user_id, col > 0)
+                .group_by(func.strftime('%Y-%W', cls.date))
+            )
+        else:
+            base = select(func.date(cls.date).label('fecha'), col.label('valor'), cls.id) \
+                .where(cls.user_id == user_id, col > 0)
+        base = base.subquery('base')
+
+        columnas = [base.c.fecha, base.c.valor]
+        if rolling and rolling > 1:
+            orden = (base.c.fecha, base.c.id) if bucket != 'week' else (base.c.fecha,)
+            columnas.append(func.avg(base.c.valor).over(order_by=orden, rows=(-(rolling - 1), 0)).label('media'))
+        ventana = select(*columnas).subquery('ventana')
+
+        consulta = select(ventana)
+        if desde:
+            consulta = consulta.where(ventana.c.fecha >= desde.strftime('%Y-%m-%d'))
+        if hasta:
+            consulta = consulta.where(ventana.c.fecha <= hasta.strftime('%Y-%m-%d'))
+        consulta = consulta.order_by(ventana.c.fecha)
+
+        puntos = []
+        for r in db.session.execute(consulta):
+            punto = {'date': r.fecha, 'value': round(r.valor, 2)}
+            if 'media' in r._fields:
+                punto['avg'] = round(r.media, 2)
+            puntos.append(punto)
+
+        if max_points and len(puntos) > max_points:
+            puntos = reducir_lttb(puntos, max_points)
+        return puntos
+
+
+def reducir_lttb(puntos, n):
+    """
+    Largest-Triangle-Three-Buckets: se queda con n puntos conservando la forma de
+    la curva (picos incluidos). Conserva siempre el primero y el último.
+    """
+    if n >= len(puntos) or n < 3:
+        return puntos
+
+    xs = [datetime.strptime(p['date'], '%Y-%m-%d').toordinal() for p in puntos]
+    ys = [p['value'] for p in puntos]
+    elegidos = [puntos[0]]
+    tam = (len(puntos) - 2) / (n - 2)
+    a = 0
+
+    for i in range(n - 2):
+        # Media del siguiente tramo (el tercer vértice del triángulo)
+        ini_sig = int((i + 1) * tam) + 1
+        fin_sig = min(int((i + 2) * tam) + 1, len(puntos))
+        media_x = sum(xs[ini_sig:fin_sig]) / (fin_sig - ini_sig)
+        media_y = sum(ys[ini_sig:fin_sig]) / (fin_sig - ini_sig)
+
+        # Del tramo actual, el punto que forma el triángulo más grande
+        ini = int(i * tam) + 1
+        fin = int((i + 1) * tam) + 1
+        mejor, mejor_area = ini, -1
+        for j in range(ini, fin):
+            area = abs((xs[a] - media_x) * (ys[j] - ys[a]) - (xs[a] - xs[j]) * (media_y - ys[a]))
+            if area > mejor_area:
+                mejor, mejor_area = j, area
+        elegidos.append(puntos[mejor])
+        a = mejor
+
+    elegidos.append(puntos[-1])
+    return elegidos
+
+
+# --- KCAL DE SESIÓN (WorkoutSet / Exercise.burn_rate -> WorkoutSession.kcal) ---
+
+def kcal_serie(ws, ex):
+    """Expresión SQL equivalente a WorkoutSet.est_calories * series."""
+    return case(
+        (ex.c.muscle_group == 'Cardio', func.coalesce(ex.c.burn_rate, 0) * func.coalesce(ws.c.time, 0)),
+        else_=func.coalesce(ex.c.burn_rate, 0) * func.coalesce(ws.c.reps, 0)
+    ) * func.coalesce(ws.c.series, 1)
+
+
+def refresh_session_calories(connection, session_ids=None, exercise_ids=None):
+    """
+    Recalcula WorkoutSession.kcal en un único UPDATE. Se limita a session_ids y/o a
+    las sesiones que contienen alguno de exercise_ids; sin filtros, todas.
+    """
+    ses = WorkoutSession.__table__
+    ws = WorkoutSet.__table__
+    ex = Exercise.__table__
+
+    total = (
+        select(func.sum(kcal_serie(ws, ex)))
+        .select_from(ws.join(ex, ex.c.id == ws.c.exercise_id))
+        .where(ws.c.session_id == ses.c.id)
+        .scalar_subquery()
+    )
+    stmt = update(ses).values(kcal=func.round(func.coalesce(total, 0)))
+
+    if session_ids is not None or exercise_ids is not None:
+        conds = []
+        if session_ids:
+            conds.append(ses.c.id.in_(session_ids))
+        if exercise_ids:
+            conds.append(ses.c.id.in_(select(ws.c.session_id).where(ws.c.exercise_id.in_(exercise_ids))))
+        if not conds:
+            return
+        stmt = stmt.where(or_(*conds))
+    connection.execute(stmt)
+
+
+@event.listens_for(Session, 'after_flush')
+def _collect_dirty_calories(session, flush_context):
+    session_ids = session.info.setdefault('calories_sessions', set())
+    exercise_ids = session.info.setdefault('calories_exercises', set())
+
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, WorkoutSet):
+            session_ids.add(obj.session_id)
+            session_ids.update(get_history(obj, 'session_id').deleted)
+        elif isinstance(obj, Exercise) and obj in session.dirty:
+            if get_history(obj, 'burn_rate').has_changes() or get_history(obj, 'muscle_group').has_changes():
+                exercise_ids.add(obj.id)
+    session_ids.discard(None)
+
+
+@event.listens_for(Session, 'after_flush_postexec')
+def _refresh_dirty_calories(session, flush_context):
+    session_ids = session.info.pop('calories_sessions', set())
+    exercise_ids = session.info.pop('calories_exercises', set())
+    if not (session_ids or exercise_ids):
+        return
+
+    refresh_session_calories(session.connection(), session_ids, exercise_ids)
+
+    for obj in list(session.identity_map.values()):
+        if isinstance(obj, WorkoutSession) and (obj.id in session_ids or exercise_ids):
+            session.expire(obj, ['kcal'])
+
+
+# --- RÉCORDS (WorkoutSet -> ExerciseRecord) ---
+# Al guardar, editar o borrar sesiones se recalculan solo los pares (usuario, ejercicio)
+# tocados, dentro de la misma transacción.
+
+def refresh_exercise_records(connection, pares=None):
+    """
+    Reescribe exercise_record para los pares (user_id, exercise_id) indicados a partir
+    de workout_set. Si pares es None se reconstruye la tabla entera.
+    """
+    ses = WorkoutSession.__table__
+    ws = WorkoutSet.__table__
+    rec = ExerciseRecord.__table__
+
+    if pares is not None:
+        pares = list(pares)
+        if not pares:
+            return
+        # Los IN por columna dejan a SQLite usar los índices; el de tuplas afina
+        user_ids = {u for u, _ in pares}
+        exercise_ids = {e for _, e in pares}
+        par = tuple_(ses.c.user_id, ws.c.exercise_id)
+        connection.execute(rec.delete().where(
+            rec.c.user_id.in_(user_ids), rec.c.exercise_id.in_(exercise_ids),
+            tuple_(rec.c.user_id, rec.c.exercise_id).in_(pares)
+        ))
+    else:
+        connection.execute(rec.delete())
+
+    one_rm = ws.c.weight * (1 + ws.c.reps / 30.0)
+    orden = func.row_number().over(
+        partition_by=(ses.c.user_id, ws.c.exercise_id),
+        order_by=(ses.c.date.desc(), ses.c.id.desc(), ws.c.order.desc(), ws.c.id.desc())
+    )
+    base = (
+        select(
+            ses.c.user_id, ws.c.exercise_id, ses.c.id.label('session_id'), ses.c.date,
+            ws.c.weight, ws.c.reps, ws.c.distance, ws.c.time,
+            orden.label('pos'),
+            func.max(ws.c.weight).over(partition_by=(ses.c.user_id, ws.c.exercise_id)).label('best_weight'),
+            func.max(ws.c.reps).over(partition_by=(ses.c.user_id, ws.c.exercise_id)).label('best_reps'),
+            func.max(one_rm).over(partition_by=(ses.c.user_id, ws.c.exercise_id)).label('best_one_rm'),
+            func.max(ws.c.distance).over(partition_by=(ses.c.user_id, ws.c.exercise_id)).label('best_distance'),
+            func.max(ws.c.time).over(partition_by=(ses.c.user_id, ws.c.exercise_id)).label('best_time'),
+        )
+        .select_from(ws.join(ses, ses.c.id == ws.c.session_id))
+    )
+    if pares is not None:
+        base = base.where(ws.c.exercise_id.in_(exercise_ids), ses.c.user_id.in_(user_ids), par.in_(pares))
+    base = base.subquery('base')
+
+    columnas = ['user_id', 'exercise_id', 'last_session_id', 'last_date', 'last_weight', 'last_reps',
+                'last_distance', 'last_time', 'best_weight', 'best_reps', 'best_one_rm',
+                'best_distance', 'best_time']
+    origen = select(
+        base.c.user_id, base.c.exercise_id, base.c.session_id, base.c.date, base.c.weight, base.c.reps,
+        base.c.distance, base.c.time, base.c.best_weight, base.c.best_reps, base.c.best_one_rm,
+        base.c.best_distance, base.c.best_time,
+    ).where(base.c.pos == 1)
+    connection.execute(rec.insert().from_select(columnas, origen))
+
+
+@event.listens_for(Session, 'after_flush')
+def _collect_dirty_records(session, flush_context):
+    sets = session.info.setdefault('record_sets', set())          # (session_id, exercise_id)
+    sesiones = session.info.setdefault('record_sessions', set())  # sesiones con la fecha cambiada
+    usuarios = session.info.setdefault('record_users', {})        # session_id -> user_id (borradas)
+
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, WorkoutSet):
+            sesion_ids = {obj.session_id} | set(get_history(obj, 'session_id').deleted)
+            ejercicio_ids = {obj.exercise_id} | set(get_history(obj, 'exercise_id').deleted)
+            for sid in sesion_ids:
+                for eid in ejercicio_ids:
+                    if sid is not None and eid is not None:
+                        sets.add((sid, eid))
+        elif isinstance(obj, WorkoutSession):
+            if obj in session.deleted:
+                usuarios[obj.id] = obj.user_id
+            elif obj in session.dirty and get_history(obj, 'date').has_changes():
+                sesiones.add(obj.id)
+
+
+@event.listens_for(Session, 'after_flush_postexec')
+def _refresh_dirty_records(session, flush_context):
+    sets = session.info.pop('record_sets', set())
+    sesiones = session.info.pop('record_sessions', set())
+    usuarios = session.info.pop('record_users', {})
+    if not (sets or sesiones):
+        return
+
+    connection = session.connection()
+    ses = WorkoutSession.__table__
+    ws = WorkoutSet.__table__
+
+    # Sesiones cuya fecha cambió: afectan a todos sus ejercicios
+    if sesiones:
+        filas = connection.execute(
+            select(ws.c.session_id, ws.c.exercise_id).distinct().where(ws.c.session_id.in_(sesiones))
+        )
+        sets |= {(r.session_id, r.exercise_id) for r in filas}
+
+    # session_id -> user_id para las que siguen existiendo
+    pendientes = {sid for sid, _ in sets if sid not in usuarios}
+    if pendientes:
+        filas = connection.execute(select(ses.c.id, ses.c.user_id).where(ses.c.id.in_(pendientes)))
+        usuarios.update({r.id: r.user_id for r in filas})
+
+    pares = {(usuarios[sid], eid) for sid, eid in sets if usuarios.get(sid) is not None}
+
+    refresh_exercise_records(connection, pares)
+
+    for obj in list(session.identity_map.values()):
+        if isinstance(obj, ExerciseRecord) and (obj.user_id, obj.exercise_id) in pares:
+            session.expire(obj)
+
+
+# --- AVISOS POR USUARIO (resumen de "hoy" del dashboard) ---
+# Igual que week_change_handlers pero por usuario: se avisa cuando cambian sus
+# sesiones, series, medidas o su perfil, o el nombre de algo de sus menús.
+user_change_handlers = []
+
+
+def on_users_changed(fn):
+    user_change_handlers.append(fn)
+    return fn
+
+
+def notify_users_changed(session, user_ids):
+    """Avisa ya y otra vez tras el commit (ver notify_weeks_changed)."""
+    if not user_ids:
+        return
+    for fn in user_change_handlers:
+        fn(user_ids)
+    session.info.setdefault('users_changed', set()).update(user_ids)
+
+
+@event.listens_for(Session, 'after_commit')
+def _notify_users_after_commit(session):
+    user_ids = session.info.pop('users_changed', None)
+    if user_ids:
+        for fn in user_change_handlers:
+            fn(user_ids)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_users_after_rollback(session):
+    session.info.pop('users_changed', None)
+
+
+@event.listens_for(Session, 'after_flush')
+def _collect_changed_users(session, flush_context):
+    user_ids = session.info.setdefault('users_to_notify', set())
+    session_ids = session.info.setdefault('users_sessions', set())
+    # El menú de hoy enseña títulos y nombres: renombrar cambia el resumen de
+    # quien tenga esas recetas o ingredientes en algún menú
+    renombradas = session.info.setdefault('users_recipes', set())
+    renombrados = session.info.setdefault('users_ingredients', set())
+
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, (WorkoutSession, BodyMeasurement)):
+            user_ids.add(obj.user_id)
+        elif isinstance(obj, WorkoutSet):
+            session_ids.add(obj.session_id)
+        elif isinstance(obj, User) and obj in session.dirty:
+            user_ids.add(obj.id)
+        elif isinstance(obj, Receta) and obj in session.dirty and get_history(obj, 'title').has_changes():
+            renombradas.add(obj.id)
+        elif isinstance(obj, Ingredient) and obj in session.dirty and get_history(obj, 'name').has_changes():
+            renombrados.add(obj.id)
+
+
+@event.listens_for(Session, 'after_flush_postexec')
+def _notify_changed_users(session, flush_context):
+    user_ids = session.info.pop('users_to_notify', set())
+    session_ids = session.info.pop('users_sessions', set())
+    renombradas = session.info.pop('users_recipes', set())
+    renombrados = session.info.pop('users_ingredients', set())
+    session_ids.discard(None)
+    if session_ids:
+        ses = WorkoutSession.__table__
+        user_ids |= set(session.connection().execute(
+            select(ses.c.user_id).where(ses.c.id.in_(session_ids)).distinct()
+        ).scalars())
+    if renombradas or renombrados:
+        user_ids |= {uid for uid, _ in semanas_de(session.connection(), renombradas, renombrados)}
+    user_ids.discard(None)
+    notify_users_changed(session, user_ids)
+
+
+DIAS_SEMANA = ["Lunes", "Martes", "Miércoles", "Jueves", "Viernes", "Sábado", "Domingo"]
+
+
+def today_snapshot(user_id, hoy):
+    """
+    Todo lo que enseña el dashboard de un día en un número fijo de consultas:
+    menú del día (1), entreno (1) y medidas (4). Devuelve solo tipos JSON para
+    poder guardarlo en cualquier caché (ver cache.TodaySnapshotCache).
+    """
+    inicio = datetime(hoy.year, hoy.month, hoy.day)
+    fin = inicio + timedelta(days=1)
+    week_start = hoy - timedelta(days=hoy.weekday())
+
+    # 1. Menú de hoy
+    ms, menu = MenuSelection.__table__, MenuSemanal.__table__
+    rec, ing = Receta.__table__, Ingredient.__table__
+    filas = db.session.execute(
+        select(ms.c.tipo_comida, rec.c.title, ing.c.name, ms.c.quantity)
+        .select_from(ms.join(menu, menu.c.id == ms.c.menu_id)
+                       .outerjoin(rec, rec.c.id == ms.c.receta_id)
+                       .outerjoin(ing, ing.c.id == ms.c.ingredient_id))
+        .where(menu.c.user_id == user_id, menu.c.week_start == week_start,
+               menu.c.dia == DIAS_SEMANA[hoy.weekday()])
+        .order_by(ms.c.id)
+    )
+    comidas = {}
+    for f in filas:
+        if f.title:
+            comidas.setdefault(f.tipo_comida, []).append(f.title)
+        elif f.name:
+            comidas.setdefault(f.tipo_comida, []).append(f"{f.name} ({int(f.quantity or 0)}g)")
+
+    # 2. Entreno de hoy (kcal guardadas + nombres de ejercicios)
+    ses, ws, ex = WorkoutSession.__table__, WorkoutSet.__table__, Exercise.__table__
+    distintos = (
+        select(ex.c.name).distinct()
+        .select_from(ws.join(ex, ex.c.id == ws.c.exercise_id))
+        .where(ws.c.session_id == ses.c.id)
+        .correlate(ses)
+        .subquery('distintos')
+    )
+    nombres = select(func.group_concat(distintos.c.name, ', ')).scalar_subquery()
+    entreno = db.session.execute(
+        select(ses.c.kcal, nombres.label('summary'))
+        .where(ses.c.user_id == user_id, ses.c.date >= inicio, ses.c.date < fin)
+        .order_by(ses.c.date, ses.c.id)
+        .limit(1)
+    ).first()
+
+    # 3. Medidas: peso de hoy, último peso anterior y evolución total
+    peso_hoy = db.session.execute(
+        select(BodyMeasurement.weight)
+        .where(BodyMeasurement.user_id == user_id, BodyMeasurement.date >= inicio,
+               BodyMeasurement.date < fin, BodyMeasurement.weight.isnot(None))
+        .order_by(BodyMeasurement.date.desc(), BodyMeasurement.id.desc())
+        .limit(1)
+    ).scalar()
+
+    weight_diff = None
+    if peso_hoy is not None:
+        peso_ayer = BodyMeasurement.latest_as_of(user_id, inicio).get('weight')
+        if peso_ayer:
+            weight_diff = peso_hoy - peso_ayer
+
+    primeros = BodyMeasurement.first_known(user_id)
+    ultimos = BodyMeasurement.latest_as_of(user_id)
+    progress = []
+    metrics = [('weight', 'Peso', 'kg'), ('chest', 'Pecho', 'cm'), ('biceps', 'Bíceps', 'cm'),
+               ('hips', 'Cadera', 'cm'), ('thigh', 'Muslo', 'cm'), ('calf', 'Gemelo', 'cm')]
+    for field, label, unit in metrics:
+        val_start, val_end = primeros.get(field), ultimos.get(field)
+        if val_start is not None and val_end is not None and abs(val_end - val_start) > 0:
+            progress.append({'label': label, 'diff': round(val_end - val_start, 2), 'unit': unit})
+
+    user = db.session.get(User, user_id)  # Normalmente ya está en la sesión (current_user)
+    return {
+        'fecha': hoy.isoformat(),
+        'dia': DIAS_SEMANA[hoy.weekday()],
+        'menu': comidas,
+        'workout': {'summary': entreno.summary or '', 'total_calories': entreno.kcal or 0} if entreno else None,
+        'peso': peso_hoy,
+        'weight_diff': weight_diff,
+        'progress': progress,
+        'kcal_basal': (user.basal_metabolism or 0) if user else 0,
+    }
@@ -0,0 +1,358 @@
+import hashlib
+import json
+import os
+import re
+import secrets
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from werkzeug.utils import secure_filename
+
+import metrics
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Sin Pillow se sirve siempre el original
+    Image = None
+
+
+# --- ALMACENAMIENTO POR CONTENIDO ---
+# Cada foto se guarda como <sha256>.<ext>: dos subidas iguales son un único fichero
+# y dos subidas distintas en el mismo segundo ya no pueden pisarse.
+
+CHUNK = 1024 * 1024
+EXTENSIONES = {'jpg', 'jpeg', 'png', 'gif', 'webp', 'heic'}
+
+# Variantes reducidas: nombre -> lado mayor en píxeles
+VARIANTES = {'thumb': 320, 'medium': 1280}
+CARPETA_VARIANTES = 'thumbs'
+
+
+def _extension(filename):
+    nombre = secure_filename(filename or '')
+    ext = nombre.rsplit('.', 1)[-1].lower() if '.' in nombre else ''
+    if ext not in EXTENSIONES:
+        raise ValueError(f"Formato de imagen no permitido: {ext or 'desconocido'}")
+    return ext
+
+
+def _mover_por_hash(tmp_path, sha, ext, upload_dir):
+    filename = f"{sha.hexdigest()}.{ext}"
+    destino = os.path.join(upload_dir, filename)
+    if os.path.exists(destino):
+        os.remove(tmp_path)  # Ya la teníamos
+        # Se renueva la fecha: si estaba huérfana, el barrido la contaría como vieja
+        os.utime(destino)
+    else:
+        os.replace(tmp_path, destino)
+    encolar_variantes(upload_dir, filename)
+    return filename
+
+
+def guardar_foto(file_storage, upload_dir):
+    """
+    Vuelca la subida a un temporal por bloques calculando el hash a la vez y lo
+    mueve a su nombre definitivo. Devuelve el nombre de fichero (sin ruta).
+    """
+    ext = _extension(file_storage.filename)
+
+    os.makedirs(upload_dir, exist_ok=True)
+    sha = hashlib.sha256()
+    fd, tmp_path = tempfile.mkstemp(dir=upload_dir, prefix='.subida-')
+    try:
+        with os.fdopen(fd, 'wb') as tmp:
+            while True:
+                bloque = file_storage.stream.read(CHUNK)
+                if not bloque:
+                    break
+                sha.update(bloque)
+                tmp.write(bloque)
+                metrics.inc('uploads_bytes_written_total', len(bloque), tipo='original')
+        return _mover_por_hash(tmp_path, sha, ext, upload_dir)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+# --- SUBIDAS POR PARTES (reanudables) ---
+# El cliente pide un token, envía la foto en trozos indicando el offset y, si se
+# corta, pregunta por dónde iba y sigue. Al guardar el entreno solo manda el token.
+
+CARPETA_PARTES = '.partes'
+MAX_FOTO = 25 * 1024 * 1024
+# Un cerrojo más viejo que esto es de una petición que murió a medias
+BLOQUEO_CADUCADO = 30
+_TOKEN = re.compile(r'^[A-Za-z0-9_-]{16,64}$')
+
+
+class SubidaError(Exception):
+    """Error de una subida por partes; status es el código HTTP a devolver."""
+
+    def __init__(self, mensaje, status=400, offset=None):
+        super().__init__(mensaje)
+        self.status = status
+        self.offset = offset
+
+
+def _rutas_subida(upload_dir, token):
+    if not token or not _TOKEN.match(token):
+        raise SubidaError("Token de subida no válido", 404)
+    carpeta = os.path.join(upload_dir, CARPETA_PARTES)
+    return os.path.join(carpeta, f"{token}.part"), os.path.join(carpeta, f"{token}.json")
+
+
+def _leer_meta(upload_dir, token, user_id):
+    parte, meta_path = _rutas_subida(upload_dir, token)
+    try:
+        with open(meta_path) as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        raise SubidaError("Subida no encontrada o caducada", 404)
+    if meta['user_id'] != user_id:
+        raise SubidaError("Subida no encontrada o caducada", 404)
+    return meta, parte, meta_path
+
+
+def _guardar_meta(meta_path, meta):
+    tmp = meta_path + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(meta, f)
+    os.replace(tmp, meta_path)
+
+
+def iniciar_subida(upload_dir, user_id, filename, size):
+    ext = _extension(filename)
+    if not isinstance(size, int) or size <= 0:
+        raise SubidaError("Tamaño no válido")
+    if size > MAX_FOTO:
+        raise SubidaError(f"La foto supera el máximo de {MAX_FOTO // (1024 * 1024)} MB", 413)
+
+    token = secrets.token_urlsafe(24)
+    parte, meta_path = _rutas_subida(upload_dir, token)
+    os.makedirs(os.path.dirname(parte), exist_ok=True)
+    open(parte, 'wb').close()
+    _guardar_meta(meta_path, {'user_id': user_id, 'ext': ext, 'size': size, 'filename': None})
+    return estado_subida(upload_dir, token, user_id)
+
+
+def estado_subida(upload_dir, token, user_id):
+    meta, parte, _ = _leer_meta(upload_dir, token, user_id)
+    offset = meta['size'] if meta['filename'] else os.path.getsize(parte)
+    return {'token': token, 'offset': offset, 'size': meta['size'], 'complete': bool(meta['filename'])}
+
+
+@contextmanager
+def _bloqueo(parte):
+    """
+    Cerrojo por token con un fichero creado en exclusiva (O_EXCL), que vale
+    entre hilos y entre procesos y también en Windows. Si otra petición tiene la
+    subida se responde 503 y el cliente reintenta con espera.
+    """
+    cerrojo = parte[:-len('.part')] + '.lock'
+    for _ in range(2):
+        try:
+            os.close(os.open(cerrojo, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+            break
+        except FileExistsError:
+            try:
+                if time.time() - os.path.getmtime(cerrojo) < BLOQUEO_CADUCADO:
+                    raise SubidaError("Otra petición está escribiendo esta subida", 503)
+                os.remove(cerrojo)
+            except FileNotFoundError:
+                pass
+    else:
+        raise SubidaError("Otra petición está escribiendo esta subida", 503)
+    try:
+        yield
+    finally:
+        os.remove(cerrojo)
+
+
+def anadir_parte(upload_dir, token, user_id, offset, datos):
+    """
+    Escribe un trozo en su posición. Si el offset no es donde iba la subida se
+    responde 409 con el offset correcto para que el cliente se recoloque.
+    Comprobar, escribir y cerrar la subida van bajo el cerrojo del token: dos
+    PUT con el mismo offset a la vez no pueden añadir los dos.
+    """
+    _, parte, _ = _leer_meta(upload_dir, token, user_id)
+    with _bloqueo(parte):
+        # Se relee dentro del cerrojo: otra petición ha podido terminarla
+        meta, parte, meta_path = _leer_meta(upload_dir, token, user_id)
+        if meta['filename']:
+            return estado_subida(upload_dir, token, user_id)
+
+        actual = os.path.getsize(parte)
+        if offset != actual:
+            raise SubidaError("Offset incorrecto", 409, offset=actual)
+        if actual + len(datos) > meta['size']:
+            raise SubidaError("El trozo se pasa del tamaño anunciado", 413, offset=actual)
+
+        with open(parte, 'ab') as f:
+            f.write(datos)
+        metrics.inc('uploads_bytes_written_total', len(datos), tipo='trozo')
+
+        if actual + len(datos) == meta['size']:
+            sha = hashlib.sha256()
+            with open(parte, 'rb') as f:
+                for bloque in iter(lambda: f.read(CHUNK), b''):
+                    sha.update(bloque)
+            meta['filename'] = _mover_por_hash(parte, sha, meta['ext'], upload_dir)
+            open(parte, 'wb').close()  # Vacía, solo para que estado_subida siga funcionando
+            _guardar_meta(meta_path, meta)
+
+    return estado_subida(upload_dir, token, user_id)
+
+
+def resolver_subida(upload_dir, token, user_id):
+    """
+    Nombre final de una subida completa. No borra nada: el token sigue valiendo
+    hasta olvidar_subida(), que se llama cuando el entreno ya está guardado.
+    """
+    meta, _, _ = _leer_meta(upload_dir, token, user_id)
+    if not meta['filename']:
+        raise SubidaError("La foto aún no se ha terminado de subir", 409)
+    return meta['filename']
+
+
+def olvidar_subida(upload_dir, token):
+    """Borra la parte y la meta de un token ya usado. Si no existen no pasa nada."""
+    try:
+        rutas = _rutas_subida(upload_dir, token)
+    except SubidaError:
+        return
+    for ruta in rutas:
+        if os.path.exists(ruta):
+            os.remove(ruta)
+
+
+# --- VARIANTES (fuera de la petición) ---
+
+_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix='fotos')
+
+
+def ruta_variante(upload_dir, filename, variante):
+    stem = filename.rsplit('.', 1)[0]
+    return os.path.join(upload_dir, CARPETA_VARIANTES, f"{stem}_{variante}.jpg")
+
+
+def generar_variantes(upload_dir, filename):
+    """Crea las versiones reducidas que falten. Devuelve cuántas se han escrito."""
+    if Image is None:
+        return 0
+
+    origen = os.path.join(upload_dir, filename)
+    os.makedirs(os.path.join(upload_dir, CARPETA_VARIANTES), exist_ok=True)
+    escritas = 0
+    try:
+        with Image.open(origen) as img:
+            img = ImageOps.exif_transpose(img).convert('RGB')
+            for variante, lado in VARIANTES.items():
+                destino = ruta_variante(upload_dir, filename, variante)
+                if os.path.exists(destino):
+                    continue
+                copia = img.copy()
+                copia.thumbnail((lado, lado))
+                # Temporal propio: dos workers pueden estar con la misma foto
+                fd, tmp = tempfile.mkstemp(dir=os.path.dirname(destino), suffix='.tmp')
+                with os.fdopen(fd, 'wb') as f:
+                    copia.save(f, 'JPEG', quality=82, optimize=True)
+                os.replace(tmp, destino)
+                metrics.inc('uploads_bytes_written_total', os.path.getsize(destino), tipo='miniatura')
+                escritas += 1
+    except Exception as e:
+        print(f"Error generando miniaturas de {filename}: {e}")
+    return escritas
+
+
+def encolar_variantes(upload_dir, filename):
+    if Image is not None:
+        _pool.submit(generar_variantes, upload_dir, filename)
+
+
+def url_foto(filename, variante=None):
+    """
+    Ruta relativa a /static para la plantilla: la variante si ya existe y si no
+    (todavía en cola, o sin Pillow) el original.
+    """
+    from flask import current_app
+    upload_dir = os.path.join(current_app.root_path, current_app.config['UPLOAD_FOLDER'])
+    if variante and os.path.exists(ruta_variante(upload_dir, filename, variante)):
+        stem = filename.rsplit('.', 1)[0]
+        return f"uploads/{CARPETA_VARIANTES}/{stem}_{variante}.jpg"
+    return f"uploads/{filename}"
+
+
+# --- LIMPIEZA ---
+
+def borrar_foto(upload_dir, filename):
+    """Borra el original y sus variantes. Quien llama comprueba antes que nadie la usa."""
+    rutas = [os.path.join(upload_dir, filename)]
+    rutas += [ruta_variante(upload_dir, filename, v) for v in VARIANTES]
+    for ruta in rutas:
+        try:
+            if os.path.exists(ruta):
+                os.remove(ruta)
+        except OSError as e:
+            print(f"Error borrando archivo: {e}")
+
+
+def barrer_huerfanos(upload_dir, referenciados, margen_segundos=3600, dry_run=False):
+    """
+    Borra de upload_dir (y de sus variantes) los ficheros que ninguna sesión usa.
+    Se respetan los más nuevos que margen_segundos para no tocar subidas en curso,
+    y las subidas por partes terminadas cuyo token aún no ha usado ninguna sesión.
+    Devuelve la lista de rutas borradas (o que se borrarían con dry_run).
+    """
+    referenciados = set(referenciados)
+    limite = time.time() - margen_segundos
+    borrados = []
+
+    partes = os.path.join(upload_dir, CARPETA_PARTES)
+    limite_partes = time.time() - max(margen_segundos, 24 * 3600)
+    if os.path.isdir(partes):
+        # Subidas terminadas pero sin sesión aún: su token sigue vivo y el fichero
+        # ya está en upload_dir con su nombre final, así que cuenta como usado
+        for f in os.listdir(partes):
+            ruta = os.path.join(partes, f)
+            if not f.endswith('.json') or os.path.getmtime(ruta) <= limite_partes:
+                continue
+            try:
+                with open(ruta) as fh:
+                    nombre = json.load(fh).get('filename')
+            except (OSError, ValueError):
+                continue
+            if nombre:
+                referenciados.add(nombre)
+    stems = {f.rsplit('.', 1)[0] for f in referenciados}
+
+    candidatos = [(os.path.join(upload_dir, f), f not in referenciados) for f in os.listdir(upload_dir)]
+    carpeta = os.path.join(upload_dir, CARPETA_VARIANTES)
+    if os.path.isdir(carpeta):
+        for f in os.listdir(carpeta):
+            stem = f.rsplit('_', 1)[0]
+            candidatos.append((os.path.join(carpeta, f), stem not in stems))
+
+    if os.path.isdir(partes):
+        # Subidas abandonadas: ningún token vive más de un día
+        candidatos += [(os.path.join(partes, f), True) for f in os.listdir(partes)]
+
+    for ruta, huerfano in candidatos:
+        if os.path.dirname(ruta) == partes and os.path.getmtime(ruta) > limite_partes:
+            continue
+        if not huerfano or not os.path.isfile(ruta) or os.path.getmtime(ruta) > limite:
+            continue
+        borrados.append(ruta)
+        if not dry_run:
+            try:
+                os.remove(ruta)
+            except OSError as e:
+                print(f"Error borrando {ruta}: {e}")
+    return borrados
+
+
+def init_app(app):
+    app.jinja_env.globals['url_foto'] = url_foto
@@ -0,0 +1,207 @@
+import cProfile
+import io
+import json
+import os
+import pstats
+import random
+import re
+import threading
+import time
+
+from flask import current_app, g, request
+
+
+# --- PERFILADO BAJO DEMANDA ---
+# Una petición se perfila si un admin lo pide (?_profile=1 o cabecera X-Profile: 1)
+# o si cae en el muestreo (PROFILE_SAMPLE_RATE, 0 por defecto). Si no, el único
+# coste es mirar un parámetro y una cabecera.
+# Por cada petición perfilada se guardan en PROFILE_DIR:
+#   <id>.prof       pstats (snakeviz, python -m pstats ...)
+#   <id>.collapsed  pilas plegadas para flamegraph.pl / speedscope
+#   <id>.json       ruta, tiempo y motivo, para el listado de /admin/profiles
+
+MAX_PERFILES = 200
+_NOMBRE = re.compile(r'^[\w-]+\.(prof|collapsed|json)$')
+
+# cProfile no admite dos perfiles activos a la vez en el mismo proceso (3.12+).
+# El cerrojo solo evita ese error: desde 3.12 el perfil usa sys.monitoring, que
+# es de todo el proceso, así que con un servidor con hilos también recoge lo que
+# hagan a la vez las peticiones de otros hilos (antes de 3.12 solo el propio).
+_ocupado = threading.Lock()
+
+
+def _motivo():
+    if request.args.get('_profile') == '1' or request.headers.get('X-Profile') == '1':
+        from flask_login import current_user
+        if current_user.is_authenticated and current_user.is_admin:
+            return 'admin'
+        return None
+    tasa = current_app.config.get('PROFILE_SAMPLE_RATE') or 0
+    if tasa and random.random() < tasa:
+        return 'muestreo'
+    return None
+
+
+def _empezar():
+    motivo = _motivo()
+    if not motivo or not _ocupado.acquire(blocking=False):
+        return
+    g.perfil = (cProfile.Profile(), motivo, time.perf_counter())
+    g.perfil[0].enable()
+
+
+def _terminar(status):
+    perfil = g.pop('perfil', None)
+    if perfil is None:
+        return None
+    prof, motivo, inicio = perfil
+    try:
+        prof.disable()
+    finally:
+        _ocupado.release()
+
+    ms = (time.perf_counter() - inicio) * 1000
+    try:
+        return guardar(prof, {
+            'metodo': request.method, 'ruta': request.full_path.rstrip('?'), 'endpoint': request.endpoint,
+            'status': status, 'ms': round(ms, 1), 'motivo': motivo, 'fecha': time.strftime('%Y-%m-%d %H:%M:%S'),
+        })
+    except Exception as e:
+        print(f"Error guardando el perfil de {request.path}: {e}")
+        return None
+
+
+def _despues(response):
+    perfil_id = _terminar(response.status_code)
+    if perfil_id:
+        response.headers['X-Profile-Id'] = perfil_id
+    return response
+
+
+def _al_cerrar(exc):
+    # Solo queda perfil abierto si la vista lanzó una excepción (after_request no corrió)
+    if 'perfil' in g:
+        _terminar(500)
+
+
+# --- FICHEROS ---
+
+def carpeta(app=None):
+    app = app or current_app
+    return app.config.get('PROFILE_DIR') or os.path.join(app.instance_path, 'profiles')
+
+
+def pilas_plegadas(stats, minimo_us=20):
+    """
+    Convierte un pstats en pilas plegadas ("a;b;c microsegundos" por línea).
+    cProfile solo guarda pares llamador -> llamado, así que el tiempo de cada
+    función se reparte entre sus caminos en proporción a lo que aportó cada
+    llamador. Es una aproximación, pero basta para ver dónde se va el tiempo.
+    """
+    datos = stats.stats  # func -> (cc, nc, tt, ct, callers)
+    hijos = {}
+    for func, (_, _, _, _, callers) in datos.items():
+        for llamador, arista in callers.items():
+            hijos.setdefault(llamador, []).append((func, arista[3]))  # ct de esa arista
+
+    def nombre(func):
+        fichero, linea, funcion = func
+        if fichero == '~':
+            return funcion
+        # Carpeta + fichero: 'flask/app.py' y nuestro 'app.py' no deben confundirse
+        return f"{'/'.join(fichero.replace(os.sep, '/').split('/')[-2:])}:{funcion}:{linea}"
+
+    lineas = {}
+
+    def visitar(func, pila, tiempo, visitando):
+        tt, ct = datos[func][2], datos[func][3]
+        fraccion = tiempo / ct if ct else 0
+        pila = pila + [nombre(func)]
+        propio = tt * fraccion
+        if propio * 1e6 >= minimo_us:
+            clave = ';'.join(pila)
+            lineas[clave] = lineas.get(clave, 0) + propio
+        for hijo, ct_arista in hijos.get(func, []):
+            if hijo in visitando or hijo not in datos:
+                continue  # Recursión: su tiempo ya cuenta en el primer nivel
+            parte = ct_arista * fraccion
+            if parte * 1e6 < minimo_us:
+                continue
+            visitar(hijo, pila, parte, visitando | {hijo})
+
+    for raiz in [f for f, v in datos.items() if not v[4]]:
+        visitar(raiz, [], datos[raiz][3], {raiz})
+    return [f"{pila} {round(seg * 1e6)}" for pila, seg in lineas.items() if round(seg * 1e6) > 0]
+
+
+def guardar(prof, meta):
+    """Escribe los tres ficheros del perfil y devuelve su id."""
+    destino = carpeta()
+    os.makedirs(destino, exist_ok=True)
+    endpoint = re.sub(r'[^\w]', '_', meta['endpoint'] or 'sin_ruta')
+    perfil_id = f"{time.strftime('%Y%m%d-%H%M%S')}-{endpoint}-{os.urandom(3).hex()}"
+    base = os.path.join(destino, perfil_id)
+
+    prof.dump_stats(base + '.prof')
+    stats = pstats.Stats(prof)
+    with open(base + '.collapsed', 'w') as f:
+        f.write('\n'.join(pilas_plegadas(stats)) + '\n')
+    with open(base + '.json', 'w') as f:
+        json.dump(meta, f)
+
+    _podar(destino)
+    return perfil_id
+
+
+def _podar(destino):
+    metas = sorted(f for f in os.listdir(destino) if f.endswith('.json'))
+    for f in metas[:-MAX_PERFILES] if len(metas) > MAX_PERFILES else []:
+        for ext in ('.json', '.prof', '.collapsed'):
+            ruta = os.path.join(destino, f[:-len('.json')] + ext)
+            if os.path.exists(ruta):
+                os.remove(ruta)
+
+
+def listar():
+    """Perfiles guardados, del más nuevo al más viejo."""
+    destino = carpeta()
+    if not os.path.isdir(destino):
+        return []
+    perfiles = []
+    for f in sorted(os.listdir(destino), reverse=True):
+        if not f.endswith('.json'):
+            continue
+        try:
+            with open(os.path.join(destino, f)) as fh:
+                meta = json.load(fh)
+        except (OSError, ValueError):
+            continue
+        meta['id'] = f[:-len('.json')]
+        perfiles.append(meta)
+    return perfiles
+
+
+def ruta_fichero(nombre):
+    """Ruta de un fichero de perfil o None si el nombre no es válido o no existe."""
+    if not _NOMBRE.match(nombre):
+        return None
+    ruta = os.path.join(carpeta(), nombre)
+    return ruta if os.path.isfile(ruta) else None
+
+
+def resumen(perfil_id, orden='cumulative', limite=40):
+    """Las funciones más caras del perfil en texto, como lo imprime pstats."""
+    ruta = ruta_fichero(f"{perfil_id}.prof")
+    if ruta is None:
+        return None
+    salida = io.StringIO()
+    pstats.Stats(ruta, stream=salida).strip_dirs().sort_stats(orden).print_stats(limite)
+    return salida.getvalue()
+
+
+def init_app(app):
+    # PROFILE_SAMPLE_RATE: fracción de peticiones a perfilar sin pedirlo (0.01 = 1%)
+    app.config.setdefault('PROFILE_SAMPLE_RATE', float(os.environ.get('PROFILE_SAMPLE_RATE', 0) or 0))
+    app.before_request(_empezar)
+    app.after_request(_despues)
+    app.teardown_request(_al_cerrar)
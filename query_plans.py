@@ -0,0 +1,177 @@
+"""
+Comprueba con EXPLAIN QUERY PLAN que las consultas de cada ruta usan índices.
+
+    python query_plans.py        # BD temporal sembrada, resumen por ruta
+    python query_plans.py -v     # además, el plan de cada consulta
+
+Sale con código 1 si alguna consulta recorre entera una tabla con datos por
+usuario. Las tablas de CATALOGOS (compartidas por todos) se pueden listar enteras.
+"""
+import os
+import re
+import sys
+import tempfile
+from datetime import date, datetime, timedelta
+
+# Tablas que algunas páginas listan completas a propósito (catálogos compartidos)
+CATALOGOS = {'ingredient', 'exercise', 'routine', 'user'}
+
+_SCAN = re.compile(r'^SCAN (\w+)(?: AS \w+)?( USING (?:COVERING )?INDEX \w+)?')
+
+
+def sembrar(db, models):
+    """Un usuario con un poco de todo; suficiente para que el planificador elija."""
+    u = models.User(username='planes', email='planes@example.com', basal_metabolism=2000)
+    u.set_password('planes')
+    otro = models.User(username='otro', email='otro@example.com')
+    otro.set_password('otro')
+    db.session.add_all([u, otro])
+    db.session.flush()
+
+    ings = [models.Ingredient(name=f'Ingrediente {i}', kcal_100g=50 + i, price_kg=1 + i / 10) for i in range(20)]
+    db.session.add_all(ings)
+    db.session.flush()
+    recetas = []
+    for j in range(8):
+        r = models.Receta(title=f'Receta {j}', user_id=u.id)
+        db.session.add(r)
+        db.session.flush()
+        for k in range(3):
+            db.session.add(models.RecipeIngredient(recipe_id=r.id, ingredient_id=ings[(j + k) % 20].id, quantity_g=100))
+        recetas.append(r)
+
+    hoy = date.today()
+    semana = hoy - timedelta(days=hoy.weekday())
+    for i, dia in enumerate(models.DIAS_SEMANA):
+        m = models.MenuSemanal(user_id=u.id, week_start=semana, dia=dia)
+        db.session.add(m)
+        db.session.flush()
+        db.session.add(models.MenuSelection(menu_id=m.id, tipo_comida='Comida', receta_id=recetas[i % 8].id))
+        db.session.add(models.MenuSelection(menu_id=m.id, tipo_comida='Cena', ingredient_id=ings[i].id, quantity=150))
+
+    ejercicios = [models.Exercise(name=f'Ejercicio {i}', user_id=u.id, burn_rate=0.5,
+                                  muscle_group='Cardio' if i == 0 else 'Pecho') for i in range(6)]
+    db.session.add_all(ejercicios)
+    db.session.flush()
+    rutina = models.Routine(name='Rutina', user_id=u.id)
+    db.session.add(rutina)
+    db.session.flush()
+    for i, ex in enumerate(ejercicios[:3]):
+        db.session.add(models.RoutineExercise(routine_id=rutina.id, exercise_id=ex.id, order=i))
+
+    for d in range(30):
+        s = models.WorkoutSession(user_id=u.id, date=datetime.now() - timedelta(days=d))
+        db.session.add(s)
+        db.session.flush()
+        for i, ex in enumerate(ejercicios[:3]):
+            db.session.add(models.WorkoutSet(session_id=s.id, exercise_id=ex.id, weight=40 + d, reps=8, series=3, order=i))
+        db.session.add(models.BodyMeasurement(user_id=u.id, date=datetime.now() - timedelta(days=d),
+                                              weight=80 - d / 10, chest=100 if d % 7 == 0 else None))
+    db.session.add(models.ShoppingItem(nombre='Leche', user_id=u.id))
+    db.session.commit()
+    return u, rutina, ejercicios[1], recetas[0], s
+
+
+def rutas(u, rutina, ejercicio, receta, sesion):
+    semana = (date.today() - timedelta(days=date.today().weekday())).isoformat()
+    hoy = date.today().isoformat()
+    return [
+        ('GET', '/', None),
+        ('GET', '/recetas', None),
+        ('GET', '/recetas?sort=kcal&dir=desc', None),
+        ('GET', '/api/search/ingredients?q=ingre', None),
+        ('GET', '/api/search/recipes?q=rec', None),
+        ('GET', f'/menu/{semana}', None),
+        ('POST', f'/menu/{semana}', {'Lunes_Comida_receta': str(receta.id)}),
+        ('GET', '/shopping_list', None),
+        ('GET', f'/edit_recipe/{receta.id}', None),
+        ('GET', '/gym', None),
+        ('GET', '/gym/history', None),
+        ('GET', f'/gym/session/{sesion.id}', None),
+        ('GET', f'/gym/log?routine_id={rutina.id}', None),
+        ('POST', '/gym/log', {'workout_data': f'[{{"id": {ejercicio.id}, "weight": 50, "reps": 5, "series": 3}}]'}),
+        ('POST', f'/gym/session/edit/{sesion.id}', {'note': 'x', 'date': f'{hoy}T07:00'}),
+        ('GET', f'/gym/progress/{ejercicio.id}', None),
+        ('GET', f'/api/gym/progress/{ejercicio.id}?max_points=50', None),
+        ('POST', f'/gym/exercises/edit/{ejercicio.id}', {'name': ejercicio.name, 'muscle_group': 'Pecho', 'burn_rate': '0.7'}),
+        ('GET', '/gym/measurements', None),
+        ('GET', '/api/gym/measurements?metric=weight&rolling=7', None),
+        ('GET', f'/gym/routines/edit/{rutina.id}', None),
+    ]
+
+
+def problemas_del_plan(filas):
+    """Devuelve las líneas del plan que recorren entera una tabla por usuario."""
+    from models import db
+    tablas = set(db.metadata.tables)
+    malas = []
+    for fila in filas:
+        detalle = fila[-1]
+        m = _SCAN.match(detalle)
+        if m and m.group(1) in tablas and m.group(1) not in CATALOGOS:
+            malas.append(detalle)
+    return malas
+
+
+def main(argv):
+    verbose = '-v' in argv
+    carpeta = tempfile.mkdtemp(prefix='planes-')
+    os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(carpeta, 'planes.db')}"
+
+    from sqlalchemy import event
+    import models
+    from app import app, db
+
+    app.config['WTF_CSRF_ENABLED'] = False
+    app.config['ACCESS_LOG'] = False
+    capturadas = []
+
+    with app.app_context():
+        db.create_all()
+        u, rutina, ejercicio, receta, sesion = sembrar(db, models)
+        lista = rutas(u, rutina, ejercicio, receta, sesion)
+
+        @event.listens_for(db.engine, 'before_cursor_execute')
+        def _capturar(conn, cursor, statement, parameters, context, executemany):
+            if not executemany and statement.lstrip().upper().startswith(('SELECT', 'UPDATE', 'DELETE', 'INSERT', 'WITH')):
+                capturadas.append((statement, parameters))
+
+        user_id = u.id
+
+    fallos = 0
+    for metodo, url, datos in lista:
+        capturadas.clear()
+        client = app.test_client()
+        with client.session_transaction() as s:
+            s['_user_id'] = str(user_id)
+            s['_fresh'] = True
+        r = client.open(url, method=metodo, data=datos)
+        consultas = list(capturadas)
+
+        malas = []
+        with app.app_context():
+            with db.engine.connect() as conn:
+                for sql, params in consultas:
+                    plan = conn.exec_driver_sql('EXPLAIN QUERY PLAN ' + sql, params).fetchall()
+                    errores = problemas_del_plan(plan)
+                    if errores:
+                        malas.append((sql, errores))
+                    if verbose:
+                        print(f"    {' '.join(sql.split())[:110]}")
+                        for fila in plan:
+                            print(f"        {fila[-1]}")
+
+        estado = 'OK ' if not malas and r.status_code < 400 else 'MAL'
+        print(f"{estado} {metodo:4} {url} ({r.status_code}, {len(consultas)} consultas)")
+        for sql, errores in malas:
+            print(f"      {' '.join(sql.split())[:140]}")
+            for e in errores:
+                print(f"        ✗ {e}")
+        fallos += bool(malas) or r.status_code >= 400
+
+    print(f"\n{len(lista)} rutas revisadas, {fallos} con problemas.")
+    return 1 if fallos else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,192 @@
+"""
+Genera datos sintéticos con volumen realista para medir la app (ver benchmark.py).
+
+    python seed.py --db bench.db                       # 3 usuarios, 2 años de datos
+    python seed.py --db bench.db --users 10 --years 5 --recipes 800 --ingredients 3000
+
+Los usuarios se llaman demo1..demoN con contraseña 'demo'. Se escribe con
+INSERTs masivos (sin pasar por el ORM), así que al final se recalculan a mano
+los totales que normalmente mantienen los eventos de models.py.
+No se recomienda apuntar --db a home_manager.db: añade datos, no los sustituye.
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import date, datetime, timedelta
+
+LOTE = 5000
+TIPOS_COMIDA = ['Desayuno', 'Comida', 'Merienda', 'Cena']
+GRUPOS = ['Pecho', 'Espalda', 'Pierna', 'Hombro', 'Bíceps', 'Tríceps', 'Abdominales', 'Cardio']
+PALABRAS = ['pollo', 'arroz', 'tomate', 'lentejas', 'atún', 'pasta', 'huevo', 'avena', 'queso',
+            'espinacas', 'salmón', 'patata', 'garbanzos', 'yogur', 'pavo', 'calabacín', 'plátano']
+
+
+def _insertar(db, tabla, filas):
+    """INSERT por lotes (executemany) directamente con Core."""
+    from sqlalchemy import insert
+    for i in range(0, len(filas), LOTE):
+        db.session.execute(insert(tabla), filas[i:i + LOTE])
+
+
+def _siguiente_id(db, modelo):
+    from sqlalchemy import func, select
+    return (db.session.execute(select(func.max(modelo.id))).scalar() or 0) + 1
+
+
+def sembrar(db, models, usuarios=3, anios=2, ingredientes=2000, recetas=300, semilla=0):
+    """
+    Rellena la BD de la app activa. Los ids se asignan aquí (a partir del máximo
+    existente) para poder enlazar las tablas sin releerlas. Devuelve los ids de
+    usuario creados.
+    """
+    rnd = random.Random(semilla)
+    hoy = date.today()
+    inicio = hoy - timedelta(days=365 * anios)
+    lunes_actual = hoy - timedelta(days=hoy.weekday())
+
+    # 1. Usuarios (un solo hash: calcularlo por usuario es lo más lento de todo)
+    plantilla = models.User(username='x', email='x')
+    plantilla.set_password('demo')
+    uid = _siguiente_id(db, models.User)
+    users = []
+    for n in range(usuarios):
+        nombre = f"demo{uid + n}"
+        users.append({'id': uid + n, 'username': nombre, 'email': f"{nombre}@example.com",
+                      'password_hash': plantilla.password_hash, 'is_admin': False,
+                      'age': rnd.randint(20, 60), 'height': rnd.randint(155, 195),
+                      'weight': rnd.randint(55, 100), 'gender': rnd.choice(['Male', 'Female']),
+                      'target_weight': rnd.randint(55, 90), 'basal_metabolism': rnd.randint(1400, 2100)})
+    _insertar(db, models.User.__table__, users)
+    user_ids = [u['id'] for u in users]
+
+    # 2. Catálogo de ingredientes (compartido)
+    iid = _siguiente_id(db, models.Ingredient)
+    ings = []
+    for n in range(ingredientes):
+        nombre = f"{rnd.choice(PALABRAS).capitalize()} {rnd.choice(PALABRAS)} {iid + n}"
+        ings.append({'id': iid + n, 'name': nombre, 'name_search': models.normalizar_texto(nombre),
+                     'kcal_100g': round(rnd.uniform(10, 600), 1), 'price_kg': round(rnd.uniform(0.5, 30), 2)})
+    _insertar(db, models.Ingredient.__table__, ings)
+    ing_ids = [i['id'] for i in ings]
+
+    rid = _siguiente_id(db, models.Receta)
+    eid = _siguiente_id(db, models.Exercise)
+    rtid = _siguiente_id(db, models.Routine)
+    mid = _siguiente_id(db, models.MenuSemanal)
+    sid = _siguiente_id(db, models.WorkoutSession)
+    recs, rec_ings, exs, rutinas, rut_exs = [], [], [], [], []
+    menus, sels, sesiones, sets, medidas, compra = [], [], [], [], [], []
+
+    for user_id in user_ids:
+        # 3. Recetas con 3-10 ingredientes
+        mis_recetas = []
+        for _ in range(recetas):
+            titulo = f"{rnd.choice(PALABRAS).capitalize()} con {rnd.choice(PALABRAS)} {rid}"
+            recs.append({'id': rid, 'title': titulo, 'title_search': models.normalizar_texto(titulo),
+                         'description': 'Receta generada', 'steps': '1. Mezclar\n2. Cocinar', 'user_id': user_id})
+            for ing_id in rnd.sample(ing_ids, min(len(ing_ids), rnd.randint(3, 10))):
+                rec_ings.append({'recipe_id': rid, 'ingredient_id': ing_id, 'quantity_g': rnd.randint(10, 400)})
+            mis_recetas.append(rid)
+            rid += 1
+
+        # 4. Ejercicios y dos rutinas
+        mis_ejercicios = []
+        for n, grupo in enumerate(GRUPOS * 2):
+            exs.append({'id': eid, 'name': f"{grupo} {n + 1}", 'muscle_group': grupo, 'user_id': user_id,
+                        'burn_rate': 8.0 if grupo == 'Cardio' else round(rnd.uniform(0.2, 0.8), 2)})
+            mis_ejercicios.append((eid, grupo))
+            eid += 1
+        for r in range(2):
+            rutinas.append({'id': rtid, 'name': f"Rutina {'AB'[r]}", 'description': '', 'user_id': user_id})
+            for orden, (ex_id, _) in enumerate(rnd.sample(mis_ejercicios, 6)):
+                rut_exs.append({'routine_id': rtid, 'exercise_id': ex_id, 'order': orden, 'series': 3})
+            rtid += 1
+
+        # 5. Menú completo de cada semana (4 comidas x 7 días)
+        semana = inicio - timedelta(days=inicio.weekday())
+        while semana <= lunes_actual:
+            for dia in models.DIAS_SEMANA:
+                menus.append({'id': mid, 'user_id': user_id, 'week_start': semana, 'dia': dia})
+                for tipo in TIPOS_COMIDA:
+                    if rnd.random() < 0.8:
+                        sels.append({'menu_id': mid, 'tipo_comida': tipo, 'receta_id': rnd.choice(mis_recetas),
+                                     'ingredient_id': None, 'quantity': 0})
+                    else:
+                        sels.append({'menu_id': mid, 'tipo_comida': tipo, 'receta_id': None,
+                                     'ingredient_id': rnd.choice(ing_ids), 'quantity': rnd.randint(50, 300)})
+                mid += 1
+            semana += timedelta(days=7)
+
+        # 6. Entrenos (~4 por semana) y medidas diarias (peso a diario, el resto semanal)
+        peso = float(rnd.randint(60, 100))
+        dia = inicio
+        while dia <= hoy:
+            momento = datetime.combine(dia, datetime.min.time()) + timedelta(hours=rnd.randint(7, 20))
+            if rnd.random() < 4 / 7:
+                sesiones.append({'id': sid, 'user_id': user_id, 'date': momento, 'note': '', 'kcal': 0})
+                for orden, (ex_id, grupo) in enumerate(rnd.sample(mis_ejercicios, rnd.randint(4, 7))):
+                    if grupo == 'Cardio':
+                        sets.append({'session_id': sid, 'exercise_id': ex_id, 'order': orden, 'series': 1,
+                                     'weight': 0, 'reps': 0, 'distance': round(rnd.uniform(2, 10), 1),
+                                     'time': rnd.randint(15, 60)})
+                    else:
+                        sets.append({'session_id': sid, 'exercise_id': ex_id, 'order': orden,
+                                     'series': rnd.randint(2, 5), 'weight': rnd.randint(10, 120),
+                                     'reps': rnd.randint(5, 15), 'distance': 0, 'time': 0})
+                sid += 1
+
+            peso = round(peso + rnd.uniform(-0.3, 0.3), 1)
+            semanal = dia.weekday() == 0
+            medidas.append({'user_id': user_id, 'date': momento, 'weight': peso, 'sparse': True,
+                            **{m: (round(rnd.uniform(30, 110), 1) if semanal else None)
+                               for m in ('biceps', 'chest', 'hips', 'thigh', 'calf')}})
+            dia += timedelta(days=1)
+
+        for n in range(25):
+            compra.append({'nombre': f"{rnd.choice(PALABRAS)} {n}", 'cantidad': 1, 'unidad': 'ud',
+                           'completed': n % 3 == 0, 'is_auto': False, 'user_id': user_id})
+
+    # 7. Volcado en orden de dependencias
+    for modelo, filas in [(models.Receta, recs), (models.RecipeIngredient, rec_ings), (models.Exercise, exs),
+                          (models.Routine, rutinas), (models.RoutineExercise, rut_exs),
+                          (models.MenuSemanal, menus), (models.MenuSelection, sels),
+                          (models.WorkoutSession, sesiones), (models.WorkoutSet, sets),
+                          (models.BodyMeasurement, medidas), (models.ShoppingItem, compra)]:
+        _insertar(db, modelo.__table__, filas)
+        print(f"  {modelo.__tablename__}: {len(filas)} filas")
+
+    # 8. Totales guardados (los eventos del ORM no ven los INSERT masivos)
+    conn = db.session.connection()
+    models.refresh_recipe_stats(conn)
+    models.refresh_session_calories(conn)
+    models.refresh_exercise_records(conn)
+    db.session.commit()
+    return user_ids
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--db', default='bench.db', help='Fichero SQLite a rellenar (se crea si no existe).')
+    parser.add_argument('--users', type=int, default=3)
+    parser.add_argument('--years', type=int, default=2)
+    parser.add_argument('--ingredients', type=int, default=2000)
+    parser.add_argument('--recipes', type=int, default=300, help='Recetas por usuario.')
+    parser.add_argument('--seed', type=int, default=0, help='Semilla del generador (mismos datos cada vez).')
+    args = parser.parse_args(argv)
+
+    os.environ['DATABASE_URL'] = f"sqlite:///{os.path.abspath(args.db)}"
+    import models
+    from app import app, db
+
+    inicio = time.perf_counter()
+    with app.app_context():
+        db.create_all()
+        user_ids = sembrar(db, models, args.users, args.years, args.ingredients, args.recipes, args.seed)
+    print(f"Usuarios {user_ids} creados en {args.db} ({time.perf_counter() - inicio:.1f}s). Contraseña: demo")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,149 @@
+import re
+import time
+from contextlib import contextmanager
+
+from flask import current_app, g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+
+# --- CONSULTAS POR PETICIÓN ---
+# Los eventos del Engine cuentan y cronometran cada sentencia. Dentro de una
+# petición se acumulan en g; fuera (CLI, scripts) solo si hay un contar() abierto.
+
+# A partir de cuántas repeticiones de la misma sentencia se avisa de un N+1
+UMBRAL_REPETIDAS = 5
+
+# "IN (?, ?, ?)" cambia de longitud según los parámetros: cuenta como la misma
+_LISTA_PARAMS = re.compile(r'\(\s*\?(?:\s*,\s*\?)*\s*\)')
+_contadores_abiertos = []
+
+
+class EstadisticasSQL:
+    def __init__(self):
+        self.consultas = 0
+        self.tiempo = 0.0
+        self.por_sentencia = {}  # sentencia normalizada -> [veces, segundos]
+
+    def anotar(self, sentencia, segundos):
+        self.consultas += 1
+        self.tiempo += segundos
+        clave = _LISTA_PARAMS.sub('(?)', ' '.join(sentencia.split()))
+        fila = self.por_sentencia.setdefault(clave, [0, 0.0])
+        fila[0] += 1
+        fila[1] += segundos
+
+    def repetidas(self, umbral=UMBRAL_REPETIDAS):
+        """Sentencias lanzadas umbral o más veces: casi siempre un lazy-load en un bucle."""
+        return [(sql, veces, seg) for sql, (veces, seg) in self.por_sentencia.items() if veces >= umbral]
+
+    def resumen(self):
+        """Lo que pinta el panel de depuración: las sentencias de más a menos tiempo."""
+        filas = sorted(self.por_sentencia.items(), key=lambda kv: kv[1][1], reverse=True)
+        return {
+            'consultas': self.consultas,
+            'tiempo_ms': round(self.tiempo * 1000, 2),
+            'sentencias': [{'sql': sql, 'veces': v, 'ms': round(s * 1000, 2),
+                            'repetida': v >= UMBRAL_REPETIDAS} for sql, (v, s) in filas],
+        }
+
+
+def _activas():
+    activas = list(_contadores_abiertos)
+    if has_request_context() and 'sql_stats' in g:
+        activas.append(g.sql_stats)
+    return activas
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _antes(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('sql_inicio', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _despues(conn, cursor, statement, parameters, context, executemany):
+    inicio = conn.info['sql_inicio'].pop()
+    segundos = time.perf_counter() - inicio
+    for stats in _activas():
+        stats.anotar(statement, segundos)
+
+
+@event.listens_for(Engine, 'handle_error')
+def _error(contexto):
+    # La sentencia falló y no habrá after_cursor_execute: se quita su marca de inicio
+    pila = contexto.connection.info.get('sql_inicio') if contexto.connection is not None else None
+    if pila:
+        pila.pop()
+
+
+# --- AYUDAS PARA SCRIPTS Y COMPROBACIONES ---
+
+@contextmanager
+def contar():
+    """Cuenta las sentencias lanzadas dentro del bloque, haya petición o no."""
+    stats = EstadisticasSQL()
+    _contadores_abiertos.append(stats)
+    try:
+        yield stats
+    finally:
+        _contadores_abiertos.remove(stats)
+
+
+@contextmanager
+def max_consultas(maximo):
+    """
+    Falla con AssertionError si el bloque lanza más de `maximo` sentencias:
+
+        with max_consultas(4):
+            client.get('/gym/history')
+    """
+    with contar() as stats:
+        yield stats
+    if stats.consultas > maximo:
+        detalle = '\n'.join(f"  {v}x {sql[:120]}" for sql, (v, _) in stats.por_sentencia.items())
+        raise AssertionError(f"{stats.consultas} consultas (máximo {maximo}):\n{detalle}")
+
+
+def assert_max_consultas(client, url, maximo, method='GET', **kwargs):
+    """Pide url con el cliente de pruebas y comprueba el número de consultas. Devuelve la respuesta."""
+    with max_consultas(maximo):
+        return client.open(url, method=method, **kwargs)
+
+
+# --- INTEGRACIÓN CON FLASK ---
+
+def _inicio_peticion():
+    g.sql_stats = EstadisticasSQL()
+    g.sql_inicio = time.perf_counter()
+
+
+def _fin_peticion(response):
+    stats = g.pop('sql_stats', None)
+    if stats is None:
+        return response
+    total = time.perf_counter() - g.pop('sql_inicio')
+
+    # Server-Timing lo enseña el navegador en la pestaña de red (Timing)
+    response.headers.add('Server-Timing', f'db;dur={stats.tiempo * 1000:.1f};desc="{stats.consultas} consultas"')
+    response.headers.add('Server-Timing', f'app;dur={(total - stats.tiempo) * 1000:.1f}')
+
+    for sql, veces, seg in stats.repetidas():
+        print(f"Aviso N+1 en {request.method} {request.path}: {veces}x ({seg * 1000:.1f} ms) {sql[:160]}")
+    return response
+
+
+def _panel():
+    # Se pasa la función, no el resumen: base.html la llama al final, cuando la
+    # plantilla ya ha disparado sus lazy-loads
+    activo = current_app.config.get('SQL_DEBUG_PANEL')
+    if activo is None:
+        activo = current_app.debug  # Por defecto solo en modo debug
+    if not activo or 'sql_stats' not in g:
+        return {}
+    return {'sql_panel': g.sql_stats.resumen}
+
+
+def init_app(app):
+    app.before_request(_inicio_peticion)
+    app.after_request(_fin_peticion)
+    app.context_processor(_panel)
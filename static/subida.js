@@ -0,0 +1,97 @@
+// Subida de fotos por partes y reanudable (ver /api/uploads en app.py).
+// Uso: <input type="file" name="photo" data-chunked>. Al elegir foto se sube en
+// trozos; cuando termina se manda solo el token (photo_token) con el formulario.
+// La foto nunca viaja dentro del form: si pasara de MAX_CONTENT_LENGTH el 413
+// se llevaría por delante el entreno. Si la subida falla se vacía el input para
+// poder reintentar eligiéndola otra vez; si se guarda así, va sin foto.
+(function () {
+    const TROZO = 512 * 1024;
+    const REINTENTOS = 5;
+
+    const esperar = ms => new Promise(r => setTimeout(r, ms));
+    const claveLocal = f => `subida:${f.name}:${f.size}:${f.lastModified}`;
+
+    async function pedir(url, opciones) {
+        const r = await fetch(url, Object.assign({ credentials: 'same-origin' }, opciones));
+        const json = await r.json().catch(() => ({}));
+        return { status: r.status, json };
+    }
+
+    async function abrir(file) {
+        // Si ya empezamos esta misma foto (recarga, corte de red), seguimos donde iba
+        const guardado = localStorage.getItem(claveLocal(file));
+        if (guardado) {
+            const r = await pedir(`/api/uploads/${guardado}`);
+            if (r.status === 200) return r.json;
+            localStorage.removeItem(claveLocal(file));
+        }
+        const r = await pedir('/api/uploads', {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ filename: file.name, size: file.size })
+        });
+        if (r.status !== 201) throw new Error(r.json.error || 'No se pudo iniciar la subida');
+        localStorage.setItem(claveLocal(file), r.json.token);
+        return r.json;
+    }
+
+    async function subir(file, progreso) {
+        let estado = await abrir(file);
+        let fallos = 0;
+        while (!estado.complete) {
+            const trozo = file.slice(estado.offset, estado.offset + TROZO);
+            let r;
+            try {
+                r = await pedir(`/api/uploads/${estado.token}?offset=${estado.offset}`, { method: 'PUT', body: trozo });
+            } catch (e) {
+                r = { status: 0, json: {} };
+            }
+
+            if (r.status === 200) {
+                estado = r.json;
+                fallos = 0;
+                progreso(estado.offset / estado.size);
+            } else if (r.status === 409 && r.json.offset !== undefined) {
+                estado.offset = r.json.offset; // El servidor tenía otra posición: nos recolocamos
+            } else if (r.status === 0 || r.status >= 500) {
+                if (++fallos > REINTENTOS) throw new Error('Sin conexión');
+                await esperar(1000 * 2 ** fallos);
+            } else {
+                throw new Error(r.json.error || 'Error en la subida');
+            }
+        }
+        localStorage.removeItem(claveLocal(file));
+        return estado.token;
+    }
+
+    document.querySelectorAll('input[type=file][data-chunked]').forEach(input => {
+        const form = input.form;
+        const hidden = document.createElement('input');
+        hidden.type = 'hidden';
+        hidden.name = 'photo_token';
+        form.appendChild(hidden);
+        const botones = form.querySelectorAll('button[type=submit]');
+        const etiqueta = input.parentElement.querySelector('span, p');
+
+        input.addEventListener('change', async () => {
+            const file = input.files[0];
+            hidden.value = '';
+            input.name = ''; // Con JS el formulario solo lleva el token
+            if (!file) return;
+
+            botones.forEach(b => b.disabled = true);
+            try {
+                hidden.value = await subir(file, p => {
+                    if (etiqueta) etiqueta.innerText = `${file.name} (${Math.round(p * 100)}%)`;
+                });
+                if (etiqueta) etiqueta.innerText = `${file.name} ✓`;
+            } catch (e) {
+                console.warn('Subida por partes fallida', e);
+                input.value = ''; // Así elegir la misma foto vuelve a lanzar 'change'
+                if (etiqueta) etiqueta.innerText = `${file.name}: no se pudo subir (${e.message}). Toca para reintentar; si guardas así, se guarda sin foto`;
+            } finally {
+                botones.forEach(b => b.disabled = false);
+            }
+        });
+    });
+})();